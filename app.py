@@ -1,17 +1,18 @@
 # app.py
 import streamlit as st
-from data_manager import load_data
 # 👇 這裡移除了 admin_dashboard，因為它已經搬去 pages 資料夾了
-from ui_components import apply_styles, display_products, display_cart, checkout_section
-from database import init_db, register_user, check_login 
+from ui_components import apply_styles, display_products, cart_panel
+from database import init_db, register_user, check_login, get_user_profile
+from cart_store import restore_cart, flush_user
 
 # 設定頁面資訊 (這是首頁)
 st.set_page_config(page_title="期末專題 - 商店首頁", page_icon="🌿", layout="wide")
 
-# 初始化資料庫與 Session
+# 初始化資料庫與 Session (init_db 在同一個 process 只會真正執行一次)
 init_db()
 if 'cart' not in st.session_state: st.session_state.cart = {} 
 if 'current_user' not in st.session_state: st.session_state.current_user = None 
+if 'profile' not in st.session_state: st.session_state.profile = None
 
 def main():
     # 應用 CSS 美化
@@ -27,7 +28,11 @@ def main():
         if st.session_state.current_user:
             st.success(f"Hi, {st.session_state.current_user}")
             if st.button("登出"):
+                # 購物車已存在會員帳號底下，登出前先寫入，畫面上清空
+                flush_user(st.session_state.current_user)
                 st.session_state.current_user = None
+                st.session_state.profile = None
+                st.session_state.cart = {}
                 st.rerun()
         else:
             # 未登入顯示 登入/註冊 頁籤
@@ -41,6 +46,9 @@ def main():
                     if st.button("登入", key="btn_login"):
                         if check_login(u, p):
                             st.session_state.current_user = u
+                            st.session_state.profile = get_user_profile(u)
+                            # 取回上次的購物車，並合併登入前加入的商品
+                            st.session_state.cart = restore_cart(u, st.session_state.cart)
                             st.success("登入成功！")
                             st.rerun()
                         else:
@@ -68,12 +76,11 @@ def main():
     # ==========================================
     # 商店主介面 (所有人都能看到)
     # ==========================================
-    df = load_data()          # 讀取商品資料
-    display_cart()            # 顯示購物車 (側邊欄)
-    checkout_section()        # 顯示結帳區 (側邊欄)
+    # 購物車 / 結帳、商品列表各自是 fragment，互動時只重跑自己那一塊
+    with st.sidebar:
+        cart_panel()          # 顯示購物車與結帳區 (側邊欄)
     
-    if not df.empty:
-        display_products(df)  # 顯示商品列表
+    display_products()        # 顯示商品列表 (分頁從資料庫讀取)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
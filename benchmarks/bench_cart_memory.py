@@ -0,0 +1,74 @@
+# benchmarks/bench_cart_memory.py
+# 比較 1,000 個 session 的購物車記憶體用量：
+#   舊格式：每一行存整個商品 Series.to_dict() (含很長的圖片網址)，商品表每次 rerun 都重新讀取
+#   新格式：只存 {商品編號: 數量}，明細在畫面上才從共用的商品快取對照
+# 用法：python benchmarks/bench_cart_memory.py [--sessions 1000] [--lines 5]
+import argparse
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import database
+
+def _measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return sessions, used
+
+def main():
+    parser = argparse.ArgumentParser(description="購物車 session 記憶體用量")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--lines", type=int, default=5, help="每個購物車的商品種類數")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    shutil.copy(os.path.join(ROOT, "shop.db"), os.path.join(workdir, "shop.db"))
+    database.configure_db(os.path.join(workdir, "shop.db"))
+    database.init_db()
+    product_ids = [int(i) for i in database.get_all_products()["id"]]
+    rng = random.Random(0)
+    picks = [rng.sample(product_ids, min(args.lines, len(product_ids))) for _ in range(args.sessions)]
+
+    def old_format():
+        sessions = []
+        for chosen in picks:
+            # 舊版每次 rerun 都重新讀商品表，所以每個 session 的字串都是獨立的一份
+            df = database.get_all_products().set_index("id", drop=False)
+            cart = {}
+            for product_id in chosen:
+                item = df.loc[product_id].to_dict()
+                item["quantity"] = 1
+                cart[product_id] = item
+            sessions.append(cart)
+        return sessions
+
+    def new_format():
+        return [{product_id: 1 for product_id in chosen} for chosen in picks]
+
+    _, old_bytes = _measure(old_format)
+    sessions, new_bytes = _measure(new_format)
+    # 新格式顯示購物車時共用的商品快取 (整個 process 一份)
+    catalog = {}
+    _, catalog_bytes = _measure(lambda: catalog.update(database.get_products_by_ids(product_ids)))
+
+    n = args.sessions
+    print(f"{n} sessions x {args.lines} lines")
+    print(f"old cart (full product dicts): {old_bytes / 1024:9.1f} KiB total, {old_bytes / n:7.0f} B/session")
+    print(f"new cart ({{id: quantity}}):     {new_bytes / 1024:9.1f} KiB total, {new_bytes / n:7.0f} B/session")
+    print(f"shared catalog cache:           {catalog_bytes / 1024:9.1f} KiB (once per process)")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
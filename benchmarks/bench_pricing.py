@@ -0,0 +1,93 @@
+# benchmarks/bench_pricing.py
+# 微基準：1,000 條啟用中的促銷規則，為 10,000 台購物車定價
+# 用法：python benchmarks/bench_pricing.py [--rules 1000] [--carts 10000]
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from pricing import compile_rules, price_cart
+
+CATEGORIES = [f"分類{i}" for i in range(50)]
+PRODUCTS = [(pid, CATEGORIES[pid % len(CATEGORIES)], 100 + (pid * 37) % 5000) for pid in range(1, 5001)]
+
+def make_rules(n, rng):
+    rows = []
+    for i in range(n):
+        scope = rng.choice(["all", "category", "category", "product", "product", "product"])
+        target = None
+        if scope == "category":
+            target = rng.choice(CATEGORIES)
+        elif scope == "product":
+            target = str(rng.choice(PRODUCTS)[0])
+        kind = rng.choice(["percent", "fixed"])
+        rows.append({
+            "id": i + 1, "name": f"活動{i + 1}", "code": f"CODE{i}" if rng.random() < 0.3 else None,
+            "kind": kind, "value": rng.randint(5, 30) if kind == "percent" else rng.randint(50, 500),
+            "scope": scope, "target": target, "min_spend": rng.choice([0, 0, 1000, 3000]),
+            "starts_at": None, "ends_at": rng.choice([None, "2099-12-31 23:59:59"]),
+        })
+    return rows
+
+def make_carts(n, rng, rule_count):
+    carts = []
+    for _ in range(n):
+        lines = [{"id": pid, "category": cat, "price": price, "quantity": rng.randint(1, 3)}
+                 for pid, cat, price in rng.sample(PRODUCTS, rng.randint(1, 8))]
+        code = f"CODE{rng.randrange(rule_count)}" if rng.random() < 0.3 else None
+        carts.append((lines, code))
+    return carts
+
+def naive_price(lines, code, rows):
+    # 對照組：每台購物車都把所有規則掃一遍
+    best = 0
+    subtotal = sum(l["price"] * l["quantity"] for l in lines)
+    for row in rows:
+        if row["code"] and row["code"] != (code or "").upper():
+            continue
+        if row["scope"] == "all":
+            eligible = subtotal
+        elif row["scope"] == "category":
+            eligible = sum(l["price"] * l["quantity"] for l in lines if l["category"] == row["target"])
+        else:
+            eligible = sum(l["price"] * l["quantity"] for l in lines if str(l["id"]) == row["target"])
+        if eligible <= 0 or eligible < row["min_spend"]:
+            continue
+        discount = eligible * row["value"] // 100 if row["kind"] == "percent" else min(row["value"], eligible)
+        best = max(best, discount)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="定價引擎微基準")
+    parser.add_argument("--rules", type=int, default=1000)
+    parser.add_argument("--carts", type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    rows = make_rules(args.rules, rng)
+    carts = make_carts(args.carts, rng, args.rules)
+
+    start = time.perf_counter()
+    compiled = compile_rules(rows, now="2025-01-01 00:00:00")
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    quotes = [price_cart(lines, code, compiled) for lines, code in carts]
+    engine_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [naive_price(lines, code, rows) for lines, code in carts]
+    naive_s = time.perf_counter() - start
+
+    mismatches = sum(1 for quote, want in zip(quotes, expected) if quote["discount"] != want)
+    print(f"{args.rules} rules compiled in {compile_ms:.2f} ms")
+    print(f"engine: {args.carts} carts in {engine_s * 1000:8.1f} ms ({engine_s / args.carts * 1e6:6.1f} µs/cart)")
+    print(f"naive : {args.carts} carts in {naive_s * 1000:8.1f} ms ({naive_s / args.carts * 1e6:6.1f} µs/cart)")
+    print(f"discount mismatches vs naive: {mismatches}")
+
+if __name__ == "__main__":
+    main()
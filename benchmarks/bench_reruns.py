@@ -0,0 +1,69 @@
+# benchmarks/bench_reruns.py
+# 量測每次點擊的伺服器端執行時間：整頁 rerun vs. 只重跑購物車 fragment
+# 用法：python benchmarks/bench_reruns.py [--clicks 50] [--db /tmp/bench.db]
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from streamlit.testing.v1 import AppTest
+
+def _cart_fragment_script():
+    # AppTest 不會單獨重跑 fragment，所以用只呼叫 cart_panel 的小腳本代表 fragment rerun 的工作量
+    import streamlit as st
+    from ui_components import cart_panel
+    with st.sidebar:
+        cart_panel()
+
+def _timed_runs(at, clicks, key):
+    samples = []
+    for _ in range(clicks):
+        at.button(key=key).click()
+        start = time.perf_counter()
+        at.run()
+        samples.append((time.perf_counter() - start) * 1000)
+        if at.exception:
+            raise RuntimeError(at.exception)
+    return samples
+
+def _summary(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+    print(f"{label:<28} median {statistics.median(samples):7.2f} ms   p95 {p95:7.2f} ms   (n={len(samples)})")
+
+def main():
+    parser = argparse.ArgumentParser(description="購物車 ＋ 按鈕的 rerun 時間")
+    parser.add_argument("--clicks", type=int, default=50)
+    parser.add_argument("--db", help="使用既有資料庫 (預設複製 shop.db 到暫存目錄)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = args.db or os.path.join(workdir, "shop.db")
+    if not args.db:
+        shutil.copy(os.path.join(ROOT, "shop.db"), db_path)
+    import database
+    database.configure_db(db_path)
+    database.init_db()
+
+    # 整頁 rerun：從首頁點「加入購物車」後，反覆點 ＋
+    app = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=30).run()
+    app.button(key="add_1").click().run()
+    _summary("full app rerun per click", _timed_runs(app, args.clicks, "inc_1"))
+
+    # fragment rerun：只跑購物車 + 結帳區
+    frag = AppTest.from_function(_cart_fragment_script, default_timeout=30)
+    frag.session_state["cart"] = dict(app.session_state["cart"])
+    frag.session_state["current_user"] = None
+    frag.run()
+    _summary("cart fragment rerun per click", _timed_runs(frag, args.clicks, "inc_1"))
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
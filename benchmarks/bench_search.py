@@ -0,0 +1,65 @@
+# benchmarks/bench_search.py
+# 在合成的 10 萬筆商品目錄上量測 search_products() 延遲
+# 用法：python benchmarks/bench_search.py [--products 100000] [--repeat 20] [--target-p95-ms 50]
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import database
+
+ADJECTIVES = ["高階", "電競", "無線", "降噪", "人體工學", "輕薄", "旗艦", "入門", "專業", "迷你"]
+NOUNS = ["機械鍵盤", "滑鼠", "耳機", "螢幕", "音響", "麥克風", "集線器", "辦公椅", "桌燈", "行動電源"]
+BRANDS = ["Nordic", "Aurora", "Type-C", "ProMax", "Lumen", "Zen", "Orbit", "Pixel"]
+CATEGORIES = ["3C周邊", "影音設備", "辦公家具", "玩具", "其他"]
+QUERIES = ["耳機", "降噪耳機", "鍵盤", "type", "Type-C 集線", "pro", "電競 滑鼠", "螢幕", "辦公", "nordic 音響", "行動電", "zen"]
+
+def seed_catalog(n):
+    rng = random.Random(42)
+    rows = [(None, f"{rng.choice(BRANDS)} {rng.choice(ADJECTIVES)}{rng.choice(NOUNS)} {i}",
+             rng.choice(CATEGORIES), rng.randint(100, 20000), "", None) for i in range(n)]
+    with database.transaction() as conn:
+        database.upsert_products(conn, rows)
+    database.bump_catalog_version()
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description="商品全文搜尋延遲")
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--target-p95-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    database.configure_db(os.path.join(workdir, "bench.db"))
+    database.init_db()
+    start = time.perf_counter()
+    seed_catalog(args.products)
+    print(f"seeded {args.products} products in {time.perf_counter() - start:.1f} s")
+
+    all_samples = []
+    for query in QUERIES:
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            hits = len(database.search_products(query))
+            samples.append((time.perf_counter() - start) * 1000)
+        all_samples.extend(samples)
+        print(f"{query:<14} hits {hits:>3}   p50 {percentile(samples, 50):6.2f} ms   p95 {percentile(samples, 95):6.2f} ms")
+
+    p95 = percentile(all_samples, 95)
+    print(f"overall p50 {percentile(all_samples, 50):.2f} ms, p95 {p95:.2f} ms "
+          f"({'OK' if p95 <= args.target_p95_ms else 'over'} target {args.target_p95_ms} ms)")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# benchmarks/bench_stock.py
+# 多執行緒同時搶購最後幾件商品：確認不會超賣，並量測寫入鎖的爭用 / 重試與每次結帳的延遲
+# 用法：python benchmarks/bench_stock.py [--threads 64] [--stock 10] [--quantity 1] [--busy-timeout-ms 5000]
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import database
+import order_writer
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def _reset_lock_stats():
+    with database._lock_stats_lock:
+        for key in database._lock_stats:
+            database._lock_stats[key] = 0
+
+def run(mode, threads, stock, quantity, product_id):
+    database.set_product_stock(product_id, stock)
+    _reset_lock_stats()
+    barrier = threading.Barrier(threads)
+    lock = threading.Lock()
+    results = {"ok": 0, "out_of_stock": 0, "error": 0}
+    latencies = []
+
+    def buyer(i):
+        line_items = [(product_id, 100, quantity)]
+        barrier.wait()
+        start = time.perf_counter()
+        try:
+            if mode == "writer":
+                order_writer.submit_order(f"buyer{i}", "壓測", "e", "a", 100, 100, 0, "壓測商品", line_items).result()
+            else:
+                database.save_order_to_db(f"buyer{i}", "壓測", "e", "a", 100, 100, 0, "壓測商品", line_items)
+            outcome = "ok"
+        except database.OutOfStockError:
+            outcome = "out_of_stock"
+        except Exception as e:
+            print(f"buyer{i}: {e}")
+            outcome = "error"
+        with lock:
+            results[outcome] += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    workers = [threading.Thread(target=buyer, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers: w.start()
+    for w in workers: w.join()
+    elapsed = time.perf_counter() - start
+
+    with database.get_conn() as conn:
+        left = conn.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+    expected_ok = min(threads, stock // quantity)
+    locks = database.get_lock_stats()
+    status = "OK" if results["ok"] == expected_ok and left == stock - expected_ok * quantity and left >= 0 else "OVERSOLD/LOST"
+    print(f"[{mode:<6}] {threads} buyers for {stock} units: sold {results['ok']}, out of stock {results['out_of_stock']}, "
+          f"errors {results['error']}, stock left {left} -> {status}")
+    print(f"         {elapsed * 1000:.0f} ms total, checkout p50 {percentile(latencies, 50):.1f} ms / "
+          f"p95 {percentile(latencies, 95):.1f} ms, lock wait avg {locks['wait_ms_avg']:.2f} ms / "
+          f"max {locks['wait_ms_max']:.1f} ms, retries {locks['busy_retries']}, failures {locks['busy_failures']}")
+    return status == "OK"
+
+def main():
+    parser = argparse.ArgumentParser(description="搶購最後幾件商品的併發測試")
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--stock", type=int, default=10)
+    parser.add_argument("--quantity", type=int, default=1, help="每位買家一次買幾件")
+    parser.add_argument("--busy-timeout-ms", type=int, default=database.BUSY_TIMEOUT_MS,
+                        help="調小可以觀察 busy 重試")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    database.configure_db(os.path.join(workdir, "stock.db"), busy_timeout_ms=args.busy_timeout_ms,
+                          pool_size=args.threads)
+    database.init_db()
+    with database.transaction() as conn:
+        product_id = conn.execute("INSERT INTO products (name, category, price, image) VALUES ('限量商品', '其他', 100, '')").lastrowid
+    database.bump_catalog_version()
+
+    # direct：每個執行緒自己開交易 (多條連線搶寫入鎖)；writer：經過 order_writer 的批次寫入
+    ok = run("direct", args.threads, args.stock, args.quantity, product_id)
+    ok = run("writer", args.threads, args.stock, args.quantity, product_id) and ok
+    order_writer.stop_writer()
+    shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# benchmarks/load_test.py
+# 無頭壓力測試：用 AppTest 模擬 N 個購物 session (瀏覽 → 加入購物車 → 登入結帳 → 查訂單)，
+# 另外直接呼叫 database.py 的熱門函式，統計每種操作的吞吐量與 p50/p95/p99 延遲，結果寫成 JSON 方便跨 commit 比較。
+# 用法：python benchmarks/load_test.py [--sessions 8] [--concurrency 4] [--rounds 3]
+#       [--products 5000] [--orders 20000] [--out load_test.json] [--label 說明]
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from streamlit.testing.v1 import AppTest
+
+import database
+from order_writer import stop_writer
+
+CATEGORIES = ["3C周邊", "影音設備", "辦公家具", "玩具", "其他"]
+NOUNS = ["機械鍵盤", "滑鼠", "耳機", "螢幕", "音響", "麥克風", "集線器", "辦公椅", "桌燈", "行動電源"]
+QUERIES = ["耳機", "鍵盤", "螢幕", "辦公", "電源"]
+PASSWORD = "load-test"
+
+# AppTest 的模擬 runtime 不是 thread-safe (同時執行會互相拆掉 Runtime)，所以腳本執行要排隊；
+# 資料層的直接呼叫、寫入執行緒與購物車回寫仍然是並行的。頁面操作的延遲包含排隊時間，
+# 相當於同一個 process 在 GIL 下輪流跑各 session 的腳本。
+_apptest_lock = threading.Lock()
+
+# ==========================================
+# 合成資料庫
+# ==========================================
+def seed_database(products, users, orders, rng):
+    """建立商品、會員與歷史訂單，回傳商品編號清單"""
+    rows = [(None, f"{rng.choice(NOUNS)} {i}", rng.choice(CATEGORIES), rng.randint(100, 20000), "", None)
+            for i in range(products)]
+    with database.transaction() as conn:
+        database.upsert_products(conn, rows)
+    database.bump_catalog_version()
+    for i in range(users):
+        database.register_user(f"load_user_{i}", PASSWORD, f"user{i}@example.com", f"壓測會員{i}", f"測試路 {i} 號")
+
+    with database.get_conn() as conn:
+        catalog = conn.execute("SELECT id, name, price FROM products").fetchall()
+    with database.transaction() as conn:
+        for _ in range(orders):
+            picked = rng.sample(catalog, k=min(3, len(catalog)))
+            line_items = [(pid, price, rng.randint(1, 3)) for pid, _, price in picked]
+            total = sum(price * qty for _, price, qty in line_items)
+            summary = ", ".join(f"{name} x{qty}" for (_, name, _), (_, _, qty) in zip(picked, line_items))
+            i = rng.randrange(users)
+            database.write_order(conn, f"load_user_{i}", f"壓測會員{i}", f"user{i}@example.com",
+                                 f"測試路 {i} 號", total, total, 0, summary, line_items)
+    return [pid for pid, _, _ in catalog]
+
+# ==========================================
+# 計時
+# ==========================================
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def timed(self, op, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.samples[op].append(elapsed)
+        return result
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def _run_app(at):
+    with _apptest_lock:
+        at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return at
+
+def _click(at, key=None, label=None):
+    if key:
+        at.button(key=key).click()
+    else:
+        next(b for b in at.button if label in str(b.label)).click()
+    return _run_app(at)
+
+# ==========================================
+# 單一 session 的購物流程
+# ==========================================
+def shopper_session(idx, rounds, rec, product_ids, seed):
+    rng = random.Random(seed + idx)
+    username = f"load_user_{idx}"
+    app = rec.timed("browse", _run_app, AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60))
+    app.text_input(key="login_user").input(username)
+    app.text_input(key="login_pwd").input(PASSWORD)
+    rec.timed("login", _click, app, key="btn_login")
+
+    for _ in range(rounds):
+        if any(b.key == "products_next" for b in app.button):
+            rec.timed("browse_next_page", _click, app, key="products_next")
+        app.radio[0].set_value(rng.choice(CATEGORIES))
+        rec.timed("browse_category", _run_app, app)
+        add_keys = [b.key for b in app.button if b.key and b.key.startswith("add_")]
+        for key in rng.sample(add_keys, k=min(2, len(add_keys))):
+            rec.timed("add_to_cart", _click, app, key=key)
+        rec.timed("checkout", _click, app, label="Place Order")
+
+        history = AppTest.from_file(os.path.join(ROOT, "pages", "User_Center.py"), default_timeout=60)
+        history.session_state["current_user"] = username
+        rec.timed("order_history", _run_app, history)
+
+        # 直接呼叫資料層，不經過 Streamlit
+        rec.timed("db_products_page", database.get_products_page, category=rng.choice(CATEGORIES))
+        rec.timed("db_search", database.search_products, rng.choice(QUERIES))
+        rec.timed("db_products_by_ids", database.get_products_by_ids, rng.sample(product_ids, k=5))
+        rec.timed("db_user_orders", database.get_user_orders, username)
+        rec.timed("db_orders_page", database.get_orders_page, username=username)
+
+    admin = AppTest.from_file(os.path.join(ROOT, "pages", "1_Admin_View.py"), default_timeout=60)
+    admin.session_state["admin_logged_in"] = True
+    rec.timed("admin_dashboard", _run_app, admin)
+
+def _count_orders():
+    with database.get_conn() as conn:
+        return conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="商店首頁 / 會員中心 / 後台的無頭壓力測試")
+    parser.add_argument("--sessions", type=int, default=8, help="模擬的購物 session 數")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時執行的 session 數")
+    parser.add_argument("--rounds", type=int, default=3, help="每個 session 重複幾輪 瀏覽→加購→結帳→查訂單")
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--orders", type=int, default=20000, help="預先寫入的歷史訂單數")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="load_test.json", help="JSON 結果輸出路徑")
+    parser.add_argument("--label", default="", help="寫進結果檔的說明文字")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    database.configure_db(os.path.join(workdir, "load.db"))
+    database.init_db()
+    start = time.perf_counter()
+    product_ids = seed_database(args.products, args.sessions, args.orders, random.Random(args.seed))
+    seed_sec = time.perf_counter() - start
+    print(f"seeded {args.products} products, {args.sessions} users, {args.orders} orders in {seed_sec:.1f} s")
+
+    rec = Recorder()
+    orders_before = _count_orders()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(shopper_session, i, args.rounds, rec, product_ids, args.seed)
+                   for i in range(args.sessions)]
+        for f in futures:
+            f.result()
+    wall_sec = time.perf_counter() - start
+    stop_writer()
+    orders_placed = _count_orders() - orders_before
+
+    operations = {}
+    print(f"{'operation':<20} {'n':>5} {'ops/s':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for op, samples in rec.samples.items():
+        operations[op] = {
+            "n": len(samples),
+            "throughput_per_sec": round(len(samples) / wall_sec, 2),
+            "mean_ms": round(statistics.fmean(samples), 3),
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p95_ms": round(percentile(samples, 95), 3),
+            "p99_ms": round(percentile(samples, 99), 3),
+        }
+        s = operations[op]
+        print(f"{op:<20} {s['n']:>5} {s['throughput_per_sec']:>8.1f} {s['p50_ms']:>7.1f}ms "
+              f"{s['p95_ms']:>7.1f}ms {s['p99_ms']:>7.1f}ms")
+    checkouts = len(rec.samples["checkout"])
+    print(f"{args.sessions} sessions in {wall_sec:.1f} s, {checkouts / wall_sec:.2f} checkouts/s "
+          f"({orders_placed} orders written)")
+
+    result = {
+        "label": args.label,
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "seed_sec": round(seed_sec, 2),
+        "wall_sec": round(wall_sec, 2),
+        "checkouts_per_sec": round(checkouts / wall_sec, 3),
+        "orders_placed": orders_placed,
+        "operations": operations,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"results written to {args.out}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# bulk_io.py
+# 商品目錄批次匯入 / 匯出、訂單匯出 (CSV / JSON Lines / Parquet)，串流處理，不會一次把整個檔案讀進記憶體
+import csv
+import io
+import json
+import os
+import tempfile
+import image_store
+from database import transaction, upsert_products, iter_products, iter_orders, bump_catalog_version, ORDER_COLUMNS
+
+try:  # Parquet 匯出是選配功能，沒裝 pyarrow 時只支援 CSV / JSON Lines
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+PRODUCT_FIELDS = ["id", "name", "category", "price", "image", "image_key"]
+ORDER_FIELDS = [c.strip() for c in ORDER_COLUMNS.split(",")]
+IMPORT_CHUNK_SIZE = 5000
+EXPORT_CHUNK_SIZE = 2000
+# 匯入報告最多保留幾筆錯誤明細
+MAX_REPORTED_ERRORS = 1000
+
+class _AbortImport(Exception):
+    """有錯誤或 dry run 時，用來讓 transaction() 整批 rollback"""
+
+# ==========================================
+# 讀檔與驗證
+# ==========================================
+def detect_format(filename):
+    return "jsonl" if filename.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+def _read_records(stream, fmt):
+    """逐列讀出 (列號, dict)；列號從 1 開始 (CSV 不含標題列)"""
+    if fmt == "csv":
+        for line_no, record in enumerate(csv.DictReader(stream), start=1):
+            yield line_no, record
+    else:
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, e
+                continue
+            yield line_no, record
+
+def _validate(record):
+    """回傳 (商品 tuple, None) 或 (None, 錯誤訊息)"""
+    if isinstance(record, Exception):
+        return None, f"JSON 格式錯誤：{record}"
+    if not isinstance(record, dict):
+        return None, "每一列必須是物件"
+
+    raw_id = record.get("id")
+    product_id = None
+    if raw_id not in (None, ""):
+        try:
+            product_id = int(raw_id)
+        except (TypeError, ValueError):
+            return None, f"id 不是整數：{raw_id!r}"
+        if product_id <= 0:
+            return None, f"id 必須大於 0：{product_id}"
+
+    name = str(record.get("name") or "").strip()
+    category = str(record.get("category") or "").strip()
+    if not name:
+        return None, "缺少商品名稱 (name)"
+    if not category:
+        return None, "缺少分類 (category)"
+
+    try:
+        price = int(record.get("price"))
+    except (TypeError, ValueError):
+        return None, f"價格不是整數：{record.get('price')!r}"
+    if price < 0:
+        return None, f"價格不能是負數：{price}"
+
+    image = str(record.get("image") or "").strip()
+    # 匯出檔裡的 image_key 只有在本機圖庫也有這張圖時才沿用 (換一台機器匯入就當作沒有)
+    image_key = str(record.get("image_key") or "").strip()
+    image_key = image_key if image_store.has_image(image_key) else None
+    return (product_id, name, category, price, image, image_key), None
+
+def _collect_images(stream, fmt, image_dir):
+    """
+    第一輪 (交易外)：把 image_file 欄位 (本地圖檔路徑，相對於匯入檔所在目錄) 收進本地圖庫。
+    下載與產生縮圖都很慢，不能佔著寫入鎖做；同一個路徑只處理一次。
+    回傳 {來源: (image_key, None) 或 (None, 錯誤訊息)}
+    """
+    images = {}
+    for _, record in _read_records(stream, fmt):
+        source = str(record.get("image_file") or "").strip() if isinstance(record, dict) else ""
+        if source and source not in images:
+            try:
+                images[source] = (image_store.ingest(source, image_dir), None)
+            except (OSError, ValueError) as e:
+                images[source] = (None, f"圖片無法收錄 ({source})：{e}")
+    return images
+
+def _apply_image(row, record, images):
+    """第二輪：依第一輪的結果填入 image_key，回傳 (商品 tuple, None) 或 (None, 錯誤訊息)"""
+    source = str(record.get("image_file") or "").strip()
+    if not source:
+        return row, None
+    image_key, error = images[source]
+    return (None, error) if error else (row[:5] + (image_key,), None)
+
+# ==========================================
+# 匯入
+# ==========================================
+def import_products(stream, fmt="csv", dry_run=False, skip_invalid=False, chunk_size=IMPORT_CHUNK_SIZE, image_dir=None):
+    """
+    從文字串流匯入商品，全部在同一個交易內分批 executemany。
+    - dry_run：完整驗證並試寫，但最後 rollback (圖片仍會收進圖庫，內容定址，重複匯入不會多存)
+    - skip_invalid：略過有問題的列；預設只要有任何一列錯誤就整批不寫入
+    - image_dir：image_file 欄位的相對路徑以這個目錄為準
+    檔案會讀兩輪：第一輪在交易外收錄圖片，第二輪才開寫入交易 (不能 seek 的串流先暫存到檔案)。
+    回傳報告 {"rows", "valid", "written", "errors": [(列號, 訊息), ...], "committed"}
+    """
+    if not stream.seekable():
+        spooled = tempfile.TemporaryFile("w+", encoding="utf-8", newline="")
+        for line in stream:
+            spooled.write(line)
+        stream = spooled
+    stream.seek(0)
+    images = _collect_images(stream, fmt, image_dir)
+    stream.seek(0)
+
+    report = {"rows": 0, "valid": 0, "written": 0, "errors": [], "committed": False}
+    error_count = 0
+    try:
+        with transaction() as conn:
+            chunk = []
+            for line_no, record in _read_records(stream, fmt):
+                report["rows"] += 1
+                row, error = _validate(record)
+                if not error:
+                    row, error = _apply_image(row, record, images)
+                if error:
+                    error_count += 1
+                    if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                        report["errors"].append((line_no, error))
+                    continue
+                report["valid"] += 1
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    upsert_products(conn, chunk)
+                    report["written"] += len(chunk)
+                    chunk = []
+            if chunk:
+                upsert_products(conn, chunk)
+                report["written"] += len(chunk)
+            if dry_run or (error_count and not skip_invalid):
+                raise _AbortImport()
+    except _AbortImport:
+        report["written"] = 0
+        return report
+    report["committed"] = True
+    bump_catalog_version()
+    return report
+
+def import_products_file(path, fmt=None, **kwargs):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return import_products(f, fmt or detect_format(path), image_dir=os.path.dirname(os.path.abspath(path)), **kwargs)
+
+# ==========================================
+# 匯出
+# ==========================================
+def export_products(stream, fmt="csv", chunk_size=IMPORT_CHUNK_SIZE):
+    """逐批把商品寫到文字串流，回傳筆數；輸出格式與匯入相同，可以直接再匯入"""
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(PRODUCT_FIELDS)
+        for row in iter_products(chunk_size):
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in iter_products(chunk_size):
+            stream.write(json.dumps(dict(zip(PRODUCT_FIELDS, row)), ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+def export_products_file(path, fmt=None):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        return export_products(f, fmt or detect_format(path))
+
+def export_products_bytes(fmt="csv"):
+    """給 st.download_button 用"""
+    buffer = io.StringIO()
+    export_products(buffer, fmt)
+    return buffer.getvalue().encode("utf-8-sig" if fmt == "csv" else "utf-8")
+
+# ==========================================
+# 訂單匯出 (財務報表用)
+# ==========================================
+def export_orders(stream, fmt="csv", chunk_size=EXPORT_CHUNK_SIZE, **filters):
+    """
+    把訂單逐批寫到文字串流 (CSV / JSON Lines)，回傳筆數。
+    filters 同 get_orders_page (status, date_from, date_to, username, customer_name, include_archived)；
+    記憶體用量只跟 chunk_size 有關，每批都是獨立的短查詢。
+    """
+    count = 0
+    rows = iter_orders(chunk_size, **filters)
+    if fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(ORDER_FIELDS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            stream.write(json.dumps(dict(zip(ORDER_FIELDS, row)), ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+def export_orders_parquet(path_or_file, chunk_size=EXPORT_CHUNK_SIZE, **filters):
+    """Parquet 版本：每 chunk_size 筆寫成一個 row group，回傳筆數 (需要 pyarrow)"""
+    if pq is None:
+        raise RuntimeError("匯出 Parquet 需要安裝 pyarrow")
+    schema = pa.schema([("id", pa.int64()), ("order_date", pa.string()), ("username", pa.string()),
+                        ("customer_name", pa.string()), ("customer_email", pa.string()),
+                        ("customer_address", pa.string()), ("total_amount", pa.int64()),
+                        ("original_amount", pa.int64()), ("discount", pa.int64()),
+                        ("items_summary", pa.string()), ("status", pa.string()), ("promotion_id", pa.int64())])
+    count = 0
+    chunk = []
+    with pq.ParquetWriter(path_or_file, schema) as writer:
+        for row in iter_orders(chunk_size, **filters):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                writer.write_table(pa.Table.from_pylist([dict(zip(ORDER_FIELDS, r)) for r in chunk], schema))
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            writer.write_table(pa.Table.from_pylist([dict(zip(ORDER_FIELDS, r)) for r in chunk], schema))
+            count += len(chunk)
+    return count
+
+def detect_export_format(filename):
+    return "parquet" if filename.lower().endswith(".parquet") else detect_format(filename)
+
+def export_orders_file(path, fmt=None, **filters):
+    fmt = fmt or detect_export_format(path)
+    if fmt == "parquet":
+        return export_orders_parquet(path, **filters)
+    with open(path, "w", encoding="utf-8-sig" if fmt == "csv" else "utf-8", newline="") as f:
+        return export_orders(f, fmt, **filters)
+
+def export_orders_bytes(fmt="csv", **filters):
+    """
+    給 st.download_button 用：先串流寫到暫存檔再一次讀回。
+    Streamlit 會把下載內容整份放在記憶體，所以這裡只避免 DataFrame / 字串的額外複本。
+    """
+    with tempfile.TemporaryFile() as f:
+        if fmt == "parquet":
+            export_orders_parquet(f, **filters)
+        else:
+            text = io.TextIOWrapper(f, encoding="utf-8-sig" if fmt == "csv" else "utf-8", newline="")
+            export_orders(text, fmt, **filters)
+            text.flush()
+            text.detach()
+        f.seek(0)
+        return f.read()
@@ -0,0 +1,127 @@
+# cart_store.py
+# 會員購物車的 write-behind：點擊只改記憶體，背景執行緒在使用者停手一陣子後才批次寫進 carts 表
+import atexit
+import threading
+import time
+from database import load_cart, save_carts
+
+# 最後一次異動後多久寫入；連續點擊時最晚多久一定寫入一次
+FLUSH_DELAY_SEC = 3
+MAX_FLUSH_DELAY_SEC = 15
+
+_lock = threading.Condition()
+# 取出快照 + 寫入要在同一把鎖內完成，避免舊快照比新快照晚寫進資料庫
+_write_lock = threading.Lock()
+_pending = {}        # username -> [購物車快照, 第一次未寫入的時間, 預定寫入時間]
+_thread = None
+_stats = {"marks": 0, "flushes": 0, "carts_written": 0}
+
+# ==========================================
+# 對外介面
+# ==========================================
+def mark_dirty(username, cart):
+    """購物車有異動時呼叫 (只更新記憶體，不碰資料庫)"""
+    if not username:
+        return
+    now = time.monotonic()
+    with _lock:
+        entry = _pending.get(username)
+        first_dirty = entry[1] if entry else now
+        due = min(now + FLUSH_DELAY_SEC, first_dirty + MAX_FLUSH_DELAY_SEC)
+        _pending[username] = [dict(cart), first_dirty, due]
+        _stats["marks"] += 1
+        _ensure_started()
+        _lock.notify()
+
+def flush_user(username):
+    """立刻寫入某位會員尚未寫入的購物車 (結帳 / 登出時呼叫)"""
+    with _write_lock:
+        with _lock:
+            entry = _pending.pop(username, None)
+        if entry:
+            try:
+                _write({username: entry[0]})
+            except Exception:
+                # 寫入失敗：放回去交給背景執行緒重試 (期間有新的異動就以新的為準)
+                with _lock:
+                    _pending.setdefault(username, entry)
+                    _ensure_started()
+                    _lock.notify()
+                raise
+
+def flush_all():
+    with _write_lock:
+        with _lock:
+            batch = {username: entry[0] for username, entry in _pending.items()}
+            _pending.clear()
+        if batch:
+            _write(batch)
+
+def restore_cart(username, guest_cart):
+    """
+    登入時取回會員的購物車，並把登入前 (訪客) 加入的商品合併進去。
+    尚未寫入資料庫的異動比資料庫新，優先採用。
+    """
+    with _lock:
+        entry = _pending.get(username)
+    cart = dict(entry[0]) if entry else load_cart(username)
+    for item_id, quantity in guest_cart.items():
+        cart[item_id] = cart.get(item_id, 0) + quantity
+    if guest_cart:
+        mark_dirty(username, cart)
+    return cart
+
+def get_cart_store_stats():
+    with _lock:
+        return {**_stats, "pending": len(_pending)}
+
+# ==========================================
+# 背景執行緒
+# ==========================================
+def _ensure_started():
+    # 呼叫端已持有 _lock
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_run, name="cart-writer", daemon=True)
+        _thread.start()
+
+def _run():
+    while True:
+        # 等到有購物車到期
+        with _lock:
+            while True:
+                now = time.monotonic()
+                next_due = min((e[2] for e in _pending.values()), default=None)
+                if next_due is not None and next_due <= now:
+                    break
+                _lock.wait(None if next_due is None else next_due - now)
+
+        failed = False
+        with _write_lock:
+            with _lock:
+                now = time.monotonic()
+                due = {u: e[0] for u, e in _pending.items() if e[2] <= now}
+                for username in due:
+                    del _pending[username]
+            if not due:
+                continue
+            try:
+                _write(due)
+            except Exception as e:
+                print(f"購物車寫入失敗，稍後重試：{e}")
+                with _lock:
+                    for username, cart in due.items():
+                        _pending.setdefault(username, [cart, now, now + FLUSH_DELAY_SEC])
+                failed = True
+        if failed:
+            # 放開 _write_lock 再等：結帳 / 登出的 flush_user 不必陪背景執行緒一起等
+            time.sleep(FLUSH_DELAY_SEC)
+
+def _write(batch):
+    save_carts(batch)
+    with _lock:
+        _stats["flushes"] += 1
+        _stats["carts_written"] += len(batch)
+
+# 正常關閉時把還沒寫入的購物車寫完
+atexit.register(flush_all)
@@ -0,0 +1,183 @@
+# catalog_snapshot.py
+# 商品目錄快照：欄位式 (column-oriented) 的唯讀檔案，每個 process 用 mmap 對應同一份，
+# 作業系統的 page cache 只存一份；世代號碼 (generation) 放在獨立的 8 bytes 檔案，比對它就知道目錄有沒有變。
+#
+# 目錄結構 (預設 shop.db-catalog/)：
+#   generation              目前的世代號碼 (uint64, little endian)
+#   catalog-<世代>.snap      快照本體；每個世代一個新檔，舊檔留給還在讀的 process，之後再清掉
+#
+# 快照格式 (header 固定 little endian；欄位陣列用本機的位元組順序，讀取端直接 memoryview.cast，
+# 快照只給同一台機器上的 process 用，不跨機器搬移)：
+#   header   : magic "SHOPCAT3" | generation (uint64) | 來源版本 (uint64) | 商品數 n (uint64)
+#              來源版本是資料庫 catalog_state 的變更計數，比對它就知道快照是不是落後於資料庫
+#   int64 x n: id (由小到大)、price、stock (-1 表示不追蹤庫存)
+#   uint32 x (n+1) x 4: name / category / image / image_key 的字串位移
+#   bytes    : name / category / image / image_key 的 UTF-8 內容 (依序接在一起)
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+try:  # 多個 process 同時發佈時用檔案鎖排隊；沒有 fcntl 的平台 (Windows) 就不鎖
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = b"SHOPCAT3"
+HEADER = struct.Struct("<8sQQQ")
+GENERATION = struct.Struct("<Q")
+STRING_COLUMNS = ("name", "category", "image", "image_key")
+# 保留幾個舊世代的檔案 (給切換中的 process 讀完)
+KEEP_GENERATIONS = 2
+
+def _snapshot_path(directory, generation):
+    return os.path.join(directory, f"catalog-{generation:08d}.snap")
+
+# ==========================================
+# 讀取
+# ==========================================
+class CatalogSnapshot:
+    """一個世代的商品目錄 (唯讀)，欄位直接指向 mmap 的記憶體，不會複製整份資料"""
+
+    def __init__(self, mm):
+        magic, self.generation, self.source_version, n = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError("不是商品目錄快照檔")
+        view = memoryview(mm)
+        pos = HEADER.size
+        columns = []
+        for _ in range(3):
+            columns.append(view[pos:pos + 8 * n].cast("q"))
+            pos += 8 * n
+        self._ids, self._prices, self._stock = columns
+        self._offsets = []
+        for _ in STRING_COLUMNS:
+            self._offsets.append(view[pos:pos + 4 * (n + 1)].cast("I"))
+            pos += 4 * (n + 1)
+        self._blobs = []
+        for offsets in self._offsets:
+            size = offsets[n]
+            self._blobs.append(view[pos:pos + size])
+            pos += size
+        self._categories = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _string(self, col, i):
+        offsets = self._offsets[col]
+        return str(self._blobs[col][offsets[i]:offsets[i + 1]], "utf-8")
+
+    def row(self, i):
+        stock = self._stock[i]
+        return {"id": self._ids[i], "name": self._string(0, i), "category": self._string(1, i),
+                "price": self._prices[i], "image": self._string(2, i), "stock": None if stock < 0 else stock,
+                "image_key": self._string(3, i) or None}
+
+    def get(self, product_id):
+        """依商品編號查一筆 (二分搜尋)，找不到回傳 None"""
+        i = bisect_left(self._ids, product_id)
+        if i < len(self._ids) and self._ids[i] == product_id:
+            return self.row(i)
+        return None
+
+    def _column(self, col):
+        # 整欄一次轉成 bytes / list 再切，比逐筆走 memoryview 快很多
+        blob, offsets = self._blobs[col].tobytes(), self._offsets[col].tolist()
+        return [blob[a:b].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+
+    def categories(self):
+        """所有分類，依第一次出現的商品順序 (id 由小到大)"""
+        if self._categories is None:
+            self._categories = list(dict.fromkeys(self._column(1)))
+        return self._categories
+
+class SnapshotReader:
+    """每個 process 一個：對應世代檔，世代號碼變了才重新 mmap 新的快照"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._gen_map = None
+        self._snapshot = None
+
+    def generation(self):
+        """目前發佈的世代號碼 (還沒有任何快照時是 0)；只讀共用記憶體，不會呼叫系統呼叫"""
+        if self._gen_map is None:
+            path = os.path.join(self.directory, "generation")
+            try:
+                with open(path, "rb") as f:
+                    self._gen_map = mmap.mmap(f.fileno(), GENERATION.size, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                return 0
+        return GENERATION.unpack_from(self._gen_map, 0)[0]
+
+    def snapshot(self):
+        """目前世代的快照；還沒發佈過或檔案已被清掉時回傳 None"""
+        generation = self.generation()
+        if generation == 0:
+            return None
+        if self._snapshot is None or self._snapshot.generation != generation:
+            try:
+                with open(_snapshot_path(self.directory, generation), "rb") as f:
+                    # 舊快照不主動 close：還在用它的執行緒讀完後會自動釋放
+                    self._snapshot = CatalogSnapshot(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            except (FileNotFoundError, ValueError):
+                # 檔案已被清掉，或是舊版格式 (等下一次發佈)
+                return None
+        return self._snapshot
+
+# ==========================================
+# 發佈
+# ==========================================
+def publish(directory, load_catalog):
+    """
+    寫出新世代的快照並更新世代號碼，回傳新的世代號碼。
+    load_catalog() 是 context manager，給出 (來源版本, rows)，rows 是依 id 排序的
+    (id, name, category, price, image, stock, image_key)；在檔案鎖內呼叫，確保世代越新、內容也越新。
+    """
+    os.makedirs(directory, exist_ok=True)
+    gen_path = os.path.join(directory, "generation")
+    fd = os.open(gen_path, os.O_RDWR | os.O_CREAT, 0o644)
+    with os.fdopen(fd, "r+b") as gen_file:
+        if fcntl is not None:
+            fcntl.flock(gen_file, fcntl.LOCK_EX)
+        data = gen_file.read(GENERATION.size)
+        generation = (GENERATION.unpack(data)[0] if len(data) == GENERATION.size else 0) + 1
+
+        ids, prices, stock = array("q"), array("q"), array("q")
+        offsets = [array("I", [0]) for _ in STRING_COLUMNS]
+        blobs = [bytearray() for _ in STRING_COLUMNS]
+        with load_catalog() as (source_version, rows):
+            for product_id, name, category, price, image, qty, image_key in rows:
+                ids.append(product_id)
+                prices.append(int(price or 0))
+                stock.append(-1 if qty is None else int(qty))
+                for col, text in enumerate((name, category, image, image_key)):
+                    blobs[col] += (text or "").encode("utf-8")
+                    offsets[col].append(len(blobs[col]))
+        path = _snapshot_path(directory, generation)
+        with open(path + ".tmp", "wb") as f:
+            f.write(HEADER.pack(MAGIC, generation, source_version, len(ids)))
+            for arr in (ids, prices, stock, *offsets):
+                f.write(arr.tobytes())
+            for blob in blobs:
+                f.write(blob)
+        os.replace(path + ".tmp", path)
+
+        # 快照檔寫好之後才更新世代號碼，讀取端看到新號碼時檔案一定已經存在
+        gen_file.seek(0)
+        gen_file.write(GENERATION.pack(generation))
+        gen_file.flush()
+    _cleanup(directory, generation)
+    return generation
+
+def _cleanup(directory, generation):
+    for name in os.listdir(directory):
+        if name.startswith("catalog-") and name.endswith(".snap"):
+            try:
+                if int(name[8:-5]) <= generation - KEEP_GENERATIONS:
+                    os.remove(os.path.join(directory, name))
+            except (ValueError, OSError):
+                # Windows 上還被其他 process 對應著的檔案刪不掉，下次再清
+                pass
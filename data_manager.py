@@ -1,52 +1,103 @@
 # data_manager.py
-import pandas as pd
 import streamlit as st
-from database import save_order_to_db, get_all_products
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from database import get_products_by_ids, PromotionUnavailableError, OutOfStockError
+from order_writer import submit_order
+from cart_store import mark_dirty, flush_user
+
+# 等待背景寫入 commit 的上限秒數
+ORDER_ACK_TIMEOUT = 10
 
 # ==========================================
-# 資料讀取
+# 購物車：session 只存 {商品編號: 數量}
 # ==========================================
-def load_data():
-    return get_all_products()
+def resolve_cart(cart):
+    """
+    用一次批次查詢把購物車對照目前的商品目錄 (價格以目錄為準)。
+    回傳 (明細 list, 原始總金額)，每筆明細含 id, name, category, price, image, quantity, subtotal；
+    已下架的商品會直接從購物車移除。
+    """
+    products = get_products_by_ids(cart.keys())
+    lines = []
+    for item_id, quantity in list(cart.items()):
+        product = products.get(item_id)
+        if product is None:
+            del cart[item_id]
+            continue
+        lines.append({**product, "quantity": quantity, "subtotal": product["price"] * quantity})
+    return lines, sum(line["subtotal"] for line in lines)
+
+def _cart_changed():
+    # 已登入會員的購物車交給 cart_store 延遲批次寫入，點擊本身不碰資料庫
+    mark_dirty(st.session_state.get('current_user'), st.session_state.cart)
 
 # ==========================================
 # Callback 函數
 # ==========================================
-def add_to_cart_callback(item):
-    item_id = item['id']
+def add_to_cart_callback(item, notify=True):
+    # notify=False：在 fragment 的 on_click 內呼叫時不顯示 toast (fragment callback 不支援顯示元件)
+    item_id = int(item['id'])
     if item_id in st.session_state.cart:
-        st.session_state.cart[item_id]['quantity'] += 1
-        st.toast(f"✅ {item['name']} 數量增加！")
+        st.session_state.cart[item_id] += 1
+        if notify: st.toast(f"✅ {item['name']} 數量增加！")
     else:
-        new_item = item.to_dict() if isinstance(item, pd.Series) else item
-        new_item['quantity'] = 1
-        st.session_state.cart[item_id] = new_item
-        st.toast(f"✅ 已將 {item['name']} 加入購物車！")
+        st.session_state.cart[item_id] = 1
+        if notify: st.toast(f"✅ 已將 {item['name']} 加入購物車！")
+    # 商品區的「買了這個的人也買了」以最後加入的商品為準
+    st.session_state.last_added = item_id
+    _cart_changed()
 
 def update_quantity(item_id, change):
     if item_id in st.session_state.cart:
-        st.session_state.cart[item_id]['quantity'] += change
-        if st.session_state.cart[item_id]['quantity'] <= 0:
+        st.session_state.cart[item_id] += change
+        if st.session_state.cart[item_id] <= 0:
             del st.session_state.cart[item_id]
+        _cart_changed()
 
 def clear_cart_callback():
     st.session_state.cart = {}
+    _cart_changed()
 
-def submit_order_callback(name, email, address, original_total, discount, final_total):
+def submit_order_callback(name, email, address, lines, original_total, discount, final_total, promotion_id=None):
     """
     結帳表單提交後執行的 callback。
-    接收 UI 計算好的 original_total, discount, final_total
+    接收 UI 顯示用的購物車明細 lines (resolve_cart 的結果)、定價引擎算好的 original_total, discount, final_total
+    以及套用的促銷 promotion_id
     """
     if name and address:
         buyer_account = st.session_state.get('current_user')
         
         # 整理商品清單文字
-        order_details_str = ", ".join([f"{v['name']} x{v['quantity']}" for v in st.session_state.cart.values()])
+        order_details_str = ", ".join([f"{line['name']} x{line['quantity']}" for line in lines])
+        # 訂單明細 (商品編號, 下單單價, 數量)
+        line_items = [(line['id'], line['price'], line['quantity']) for line in lines]
 
-        # 寫入資料庫
-        save_order_to_db(buyer_account, name, email, address, final_total, original_total, discount, order_details_str)
+        # 寫入資料庫：交給背景執行緒批次 commit，等到真正寫入後才回報成功
+        try:
+            submit_order(buyer_account, name, email, address, final_total, original_total, discount,
+                         order_details_str, line_items, promotion_id).result(timeout=ORDER_ACK_TIMEOUT)
+        except OutOfStockError as e:
+            names = {line['id']: line['name'] for line in lines}
+            for product_id, wanted, left in e.items:
+                st.error(f"😢 「{names.get(product_id, product_id)}」庫存不足：您要買 {wanted} 件，目前剩 {left} 件")
+            return
+        except PromotionUnavailableError:
+            st.error("😢 優惠活動已結束或名額已滿，請重新確認金額後再下單")
+            return
+        except FutureTimeoutError:
+            # 訂單還在寫入佇列裡，之後仍會寫入：不能回報失敗，否則使用者會重複下單
+            st.session_state.cart = {}
+            _cart_changed()
+            flush_user(buyer_account)
+            st.warning("⏳ 訂單處理中，請稍後到會員中心確認訂單，請勿重複下單")
+            return
+        except Exception as e:
+            st.error(f"訂單送出失敗，請稍後再試 ({e})")
+            return
         
         st.session_state.cart = {} 
+        _cart_changed()
+        flush_user(buyer_account)
         st.success("🎉 訂單已送出！(已存入資料庫)")
         st.balloons()
     else:
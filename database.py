@@ -1,17 +1,321 @@
 # database.py
+import atexit
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 import pandas as pd
 from datetime import datetime
+import catalog_snapshot
+import perf
 
 DB_NAME = "shop.db"
 
 # ==========================================
-# 資料庫初始化
+# 連線管理 (連線池 + WAL)
 # ==========================================
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
+# 可用環境變數調整：等待寫入鎖的毫秒數、連線池大小
+BUSY_TIMEOUT_MS = int(os.environ.get("SHOP_DB_BUSY_TIMEOUT_MS", "5000"))
+POOL_SIZE = int(os.environ.get("SHOP_DB_POOL_SIZE", "8"))
+# 每條連線保留的 prepared statement 數量 (相同 SQL 字串會直接重用)
+STATEMENT_CACHE_SIZE = 256
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_pool_lock = threading.Lock()
+
+def _new_connection():
+    # isolation_level=None：交易由 transaction() 明確控制
+    # check_same_thread=False：Streamlit 每次 rerun 可能換執行緒，連線要能跨執行緒重用
+    conn = sqlite3.connect(DB_NAME, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                           check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    # WAL：讀取不會擋住寫入，寫入也不會擋住讀取
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    # 全文檢索的觸發器會用到 (見 _migration_product_search)
+    conn.create_function("fts_segment", 1, fts_segment, deterministic=True)
+    # 效能量測：把執行的 SQL 文字交給 perf (見 perf.trace_sql)
+    if perf.ENABLED:
+        conn.set_trace_callback(perf.trace_sql)
+    return conn
+
+def configure_db(db_name=None, busy_timeout_ms=None, pool_size=None):
+    """切換資料庫檔案或調整連線參數 (測試 / 壓測用)，會關閉連線池內所有舊連線"""
+    global DB_NAME, BUSY_TIMEOUT_MS, POOL_SIZE, _pool, _db_ready
+    with _pool_lock:
+        _db_ready = False
+        if db_name is not None: DB_NAME = db_name
+        if busy_timeout_ms is not None: BUSY_TIMEOUT_MS = busy_timeout_ms
+        if pool_size is not None: POOL_SIZE = pool_size
+        old_pool, _pool = _pool, queue.LifoQueue(maxsize=POOL_SIZE)
+    _drop_pending_snapshot()
+    while True:
+        try:
+            old_pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+@contextmanager
+def get_conn():
+    """從連線池借出一條連線 (讀取用)，離開 with 區塊時自動歸還"""
+    pool = _pool
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _new_connection()
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            if pool is not _pool: raise queue.Full  # configure_db() 之後舊連線直接關閉
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+# busy_timeout 用完仍拿不到寫入鎖時，再退避重試幾次
+LOCK_RETRIES = 3
+_lock_stats_lock = threading.Lock()
+_lock_stats = {"transactions": 0, "busy_retries": 0, "busy_failures": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+
+def _begin_immediate(conn):
+    """BEGIN IMMEDIATE 並記錄等待寫入鎖的時間與重試次數 (見 get_lock_stats)"""
+    start = time.perf_counter()
+    retries = 0
+    while True:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            break
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or retries >= LOCK_RETRIES:
+                with _lock_stats_lock:
+                    _lock_stats["busy_retries"] += retries
+                    _lock_stats["busy_failures"] += 1
+                raise
+            retries += 1
+            time.sleep(0.01 * 2 ** retries)
+    waited = (time.perf_counter() - start) * 1000
+    with _lock_stats_lock:
+        _lock_stats["transactions"] += 1
+        _lock_stats["busy_retries"] += retries
+        _lock_stats["wait_ms_total"] += waited
+        _lock_stats["wait_ms_max"] = max(_lock_stats["wait_ms_max"], waited)
+
+def get_lock_stats():
+    """寫入鎖的爭用情況：交易數、重試 / 失敗次數、平均與最長等待毫秒數"""
+    with _lock_stats_lock:
+        stats = dict(_lock_stats)
+    stats["wait_ms_avg"] = stats["wait_ms_total"] / stats["transactions"] if stats["transactions"] else 0
+    return stats
+
+@contextmanager
+def transaction():
+    """寫入用：BEGIN IMMEDIATE 取得寫入鎖，正常結束 COMMIT，發生例外則 ROLLBACK"""
+    with get_conn() as conn:
+        _begin_immediate(conn)
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+# ==========================================
+# 商品目錄快取 (整個 process 的所有 session 共用)
+# ==========================================
+# 商品有任何寫入就呼叫 bump_catalog_version()，版本號一變舊快取全部作廢
+_catalog_lock = threading.Lock()
+_catalog_version = 0
+_catalog_cache = {}
+_catalog_stats = {"hits": 0, "misses": 0}
+
+def get_catalog_version():
+    return _catalog_version
+
+def bump_catalog_version():
+    global _catalog_version
+    with _catalog_lock:
+        _catalog_version += 1
+        _catalog_cache.clear()
+    if SNAPSHOT_ENABLED:
+        request_catalog_snapshot()
+
+# 交易內發生的目錄變更 (例如商品售完)：要等 commit 之後才能讓快取失效，
+# 否則別的 session 可能在 commit 前讀到舊資料又放回新版本的快取。
+# 依連線 (也就是該連線上的那個交易) 記錄，別的執行緒 flush 自己的交易不會清掉這裡的標記
+_catalog_dirty_conns = set()
+_catalog_dirty_lock = threading.Lock()
+
+def _mark_catalog_dirty(conn):
+    with _catalog_dirty_lock:
+        _catalog_dirty_conns.add(conn)
+
+# 促銷名額在交易內用完時也一樣，commit 之後才讓定價規則重新編譯
+_promotions_dirty_conns = set()
+
+def _mark_promotions_dirty(conn):
+    with _catalog_dirty_lock:
+        _promotions_dirty_conns.add(conn)
+
+def flush_catalog_changes(conn):
+    """conn 上的交易 commit 之後呼叫：這個交易有目錄變更就 bump_catalog_version()，用完促銷名額就重新編譯定價規則"""
+    with _catalog_dirty_lock:
+        catalog_dirty = conn in _catalog_dirty_conns
+        promotions_dirty = conn in _promotions_dirty_conns
+        _catalog_dirty_conns.discard(conn)
+        _promotions_dirty_conns.discard(conn)
+    if promotions_dirty:
+        _bump_promotions_version()
+    if catalog_dirty:
+        bump_catalog_version()
+
+def _catalog_cached(key, loader):
+    _sync_snapshot_generation()
+    with _catalog_lock:
+        if key in _catalog_cache:
+            _catalog_stats["hits"] += 1
+            return _catalog_cache[key]
+        _catalog_stats["misses"] += 1
+        version = _catalog_version
+    value = loader()
+    with _catalog_lock:
+        # 讀取期間若有人改了商品，這份結果已經過期，不放進快取
+        if version == _catalog_version:
+            _catalog_cache[key] = value
+    return value
+
+def get_catalog_cache_stats():
+    with _catalog_lock:
+        return {**_catalog_stats, "version": _catalog_version, "entries": len(_catalog_cache)}
+
+# ==========================================
+# 商品目錄快照 (多個 process 共用一份，格式見 catalog_snapshot.py)
+# ==========================================
+# 每次 bump_catalog_version() 都會排一次背景發佈，在資料庫旁的 shop.db-catalog/ 寫出新世代；
+# 各 process 用 mmap 唯讀對應，單筆查詢與整份目錄不必再查 SQLite，也不會各自複製一份。
+# process 結束前會把還在等待的發佈做完 (manage.py 這類短命的 process 等不到背景執行緒)；
+# 快照 header 記著發佈當時資料庫的 catalog_state 計數，init_db() 發現對不上就重新發佈。
+# 不是透過本程式改了商品、又不想重啟伺服器時，執行 manage.py publish-catalog 重新發佈。
+SNAPSHOT_ENABLED = os.environ.get("SHOP_CATALOG_SNAPSHOT", "1") != "0"
+# 發佈要重讀整份目錄 (十萬筆約 0.5 秒)，放在背景執行緒做；這段時間內的多次變更合併成一次發佈
+SNAPSHOT_DEBOUNCE_MS = 200
+_snapshot_reader = None
+_snapshot_generation = 0
+# 本 process 要求發佈的次數 / 已發佈到第幾次：還沒追上時快照比資料庫舊，讀取改查資料庫
+_snapshot_requested = 0
+_snapshot_published = 0
+_publish_event = threading.Event()
+_publisher = None
+_publisher_lock = threading.Lock()
+
+def _snapshot_dir():
+    return f"{DB_NAME}-catalog"
+
+def _get_snapshot_reader():
+    global _snapshot_reader
+    reader = _snapshot_reader
+    if reader is None or reader.directory != _snapshot_dir():
+        reader = _snapshot_reader = catalog_snapshot.SnapshotReader(_snapshot_dir())
+    return reader
+
+def _sync_snapshot_generation():
+    """別的 process 發佈了新世代：本 process 的商品快取也跟著作廢 (只比對共用記憶體裡的世代號碼)"""
+    global _catalog_version, _snapshot_generation
+    if not SNAPSHOT_ENABLED:
+        return
+    generation = _get_snapshot_reader().generation()
+    if generation != _snapshot_generation:
+        with _catalog_lock:
+            _snapshot_generation = generation
+            _catalog_version += 1
+            _catalog_cache.clear()
+
+def get_catalog_snapshot():
+    """目前世代的商品目錄快照；停用、還沒發佈過或本 process 的變更還在等待發佈時回傳 None (呼叫端改查資料庫)"""
+    if not SNAPSHOT_ENABLED or _snapshot_published < _snapshot_requested:
+        return None
+    _sync_snapshot_generation()
+    return _get_snapshot_reader().snapshot()
+
+def request_catalog_snapshot():
+    """排一次背景發佈 (不等待)；呼叫端通常是剛 commit 的寫入，不該被重建快照拖慢"""
+    global _snapshot_requested, _publisher
+    with _publisher_lock:
+        _snapshot_requested += 1
+        if _publisher is None or not _publisher.is_alive():
+            _publisher = threading.Thread(target=_publisher_loop, name="catalog-publisher", daemon=True)
+            _publisher.start()
+        _publish_event.set()
+
+def _drop_pending_snapshot():
+    # 換資料庫時，舊資料庫還沒發佈的快照不再發佈 (否則會拿新資料庫的內容去發佈)
+    global _snapshot_published
+    with _publisher_lock:
+        _publish_event.clear()
+        _snapshot_published = _snapshot_requested
+
+def _publisher_loop():
+    while True:
+        _publish_event.wait()
+        time.sleep(SNAPSHOT_DEBOUNCE_MS / 1000)
+        # 先清掉事件再讀資料庫：發佈途中又有新的變更，下一輪會再發佈一次
+        with _publisher_lock:
+            if not _publish_event.is_set():
+                continue  # 等待期間換了資料庫 (見 _drop_pending_snapshot)
+            _publish_event.clear()
+            requested = _snapshot_requested
+        try:
+            publish_catalog_snapshot()
+            _mark_snapshot_published(requested)
+        except (OSError, sqlite3.Error) as e:
+            # 快照寫不出來不影響寫入本身；讀取端暫時改查資料庫，之後的變更會再發佈
+            print(e)
+
+def _mark_snapshot_published(requested):
+    global _snapshot_published
+    with _publisher_lock:
+        _snapshot_published = max(_snapshot_published, requested)
+
+def flush_catalog_snapshot():
+    """本 process 還有等待中的發佈就立刻 (在目前的執行緒) 發佈；process 結束前會自動呼叫"""
+    with _publisher_lock:
+        if _snapshot_published >= _snapshot_requested:
+            return
+        _publish_event.clear()
+        requested = _snapshot_requested
+    publish_catalog_snapshot()
+    _mark_snapshot_published(requested)
+
+atexit.register(flush_catalog_snapshot)
+
+def get_catalog_source_version():
+    """資料庫的商品目錄變更計數 (由 products 的觸發器維護，見 _migration_catalog_state)"""
+    with get_conn() as conn:
+        return conn.execute("SELECT version FROM catalog_state").fetchone()[0]
+
+def publish_catalog_snapshot():
+    """從資料庫讀出全部商品 (同一個讀取交易，內容一致)，寫成新世代的快照，回傳世代號碼"""
+    @contextmanager
+    def load_catalog():
+        with get_conn() as conn:
+            # 變更計數和商品在同一個讀取交易內讀，快照記下的計數一定對應快照的內容
+            conn.execute("BEGIN")
+            source_version = conn.execute("SELECT version FROM catalog_state").fetchone()[0]
+            yield source_version, conn.execute(
+                "SELECT id, name, category, price, image, stock, image_key FROM products ORDER BY id")
+    return catalog_snapshot.publish(_snapshot_dir(), load_catalog)
+
+# ==========================================
+# 資料庫初始化 (依 PRAGMA user_version 做 schema 遷移)
+# ==========================================
+# 每個遷移函式對應一個 schema 版本：MIGRATIONS[0] 升到版本 1，依此類推。
+# 既有的 shop.db 版本是 0，但表可能已經存在，所以每一步都要能重複執行。
+def _migration_base_schema(c):
     # 1. 使用者資料表
     c.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -64,95 +368,1095 @@ def init_db():
         c.executemany('INSERT INTO products (id, name, category, price, image) VALUES (?,?,?,?,?)', initial_products)
         print("初始化商品資料成功！")
 
-    conn.commit()
-    conn.close()
+def _migration_analytics(c):
+    # 營運統計表 (每日營收 / 訂單狀態數)，隨訂單寫入同步累加
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS daily_sales (
+            day TEXT PRIMARY KEY,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            order_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS order_status_counts (
+            status TEXT PRIMARY KEY,
+            order_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # 用既有訂單補齊 (整表重算，重複執行結果相同)
+    _rebuild_analytics(c)
+
+def _migration_order_items(c):
+    # 訂單明細表 (每筆訂單的商品、下單當下單價、數量)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            unit_price INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (order_id, product_id)
+        )
+    ''')
+    # 商品銷售統計可直接走這個覆蓋索引，不用回表
+    c.execute("CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items (product_id, quantity, unit_price)")
+    _backfill_order_items(c)
+
+def _migration_order_indexes(c):
+    # 會員中心依帳號查訂單、後台依狀態 / 日期篩選
+    # (索引本身帶 rowid，所以 ORDER BY id DESC 不需要額外排序)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_username ON orders (username)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_date ON orders (order_date)")
+
+def _migration_product_indexes(c):
+    # 商品頁依分類篩選 + 依 id 分頁
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products (category, id)")
+
+def _migration_product_search(c):
+    # 商品名稱 / 分類的 FTS5 索引。中日韓文字先用 fts_segment() 拆成單字，
+    # 查詢時再把連續的字組成片語，所以「耳機」也能找到「降噪耳機」。
+    # 觸發器會呼叫 fts_segment()，只有本模組建立的連線有註冊這個函式，
+    # 請不要用 sqlite3 指令列直接改 products。
+    c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(name, category, prefix='1 2 3')")
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, category) VALUES (new.id, fts_segment(new.name), fts_segment(new.category));
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, category ON products BEGIN
+            DELETE FROM products_fts WHERE rowid = old.id;
+            INSERT INTO products_fts (rowid, name, category) VALUES (new.id, fts_segment(new.name), fts_segment(new.category));
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            DELETE FROM products_fts WHERE rowid = old.id;
+        END
+    ''')
+    c.execute("DELETE FROM products_fts")
+    c.execute("INSERT INTO products_fts (rowid, name, category) SELECT id, fts_segment(name), fts_segment(category) FROM products")
+
+def _migration_carts(c):
+    # 會員購物車 (跨裝置 / 重新整理後保留)，由 cart_store 批次寫入
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS carts (
+            username TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (username, product_id)
+        ) WITHOUT ROWID
+    ''')
+
+def _migration_promotions(c):
+    # 促銷規則：kind = percent (value 為折扣百分比) / fixed (value 為折抵金額)
+    # scope = all / category (target 為分類名稱) / product (target 為商品編號)
+    # code 為 NULL 的規則不需要優惠碼，符合條件就自動套用
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS promotions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            code TEXT,
+            kind TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            scope TEXT NOT NULL DEFAULT 'all',
+            target TEXT,
+            min_spend INTEGER NOT NULL DEFAULT 0,
+            starts_at TEXT,
+            ends_at TEXT,
+            usage_limit INTEGER,
+            used_count INTEGER NOT NULL DEFAULT 0,
+            active INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_promotions_code ON promotions (code)")
+    # 訂單記錄套用的促銷
+    if "promotion_id" not in [row[1] for row in c.execute("PRAGMA table_info(orders)")]:
+        c.execute("ALTER TABLE orders ADD COLUMN promotion_id INTEGER")
+    # 原本寫死在結帳畫面的 VIP888 九折
+    if c.execute("SELECT count(*) FROM promotions WHERE code = 'VIP888'").fetchone()[0] == 0:
+        c.execute("INSERT INTO promotions (name, code, kind, value, scope) VALUES ('VIP888 全館九折', 'VIP888', 'percent', 10, 'all')")
+
+# 訂單欄位 (orders 與 orders_archive 共用，封存時依這個順序搬移)
+ORDER_COLUMNS = ("id, order_date, username, customer_name, customer_email, customer_address, "
+                 "total_amount, original_amount, discount, items_summary, status, promotion_id")
+
+def _migration_orders_archive(c):
+    # 冷資料：結案很久的訂單搬到這裡，orders 只留進行中與近期的訂單
+    # id 沿用原訂單編號 (orders 是 AUTOINCREMENT，編號不會被重複使用)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS orders_archive (
+            id INTEGER PRIMARY KEY,
+            order_date TEXT, username TEXT, customer_name TEXT,
+            customer_email TEXT, customer_address TEXT,
+            total_amount INTEGER, original_amount INTEGER, discount INTEGER,
+            items_summary TEXT, status TEXT, promotion_id INTEGER,
+            archived_at TEXT
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_username ON orders_archive (username)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_date ON orders_archive (order_date)")
+
+def _migration_user_order_counts(c):
+    # 每位會員的訂單數 (會員中心分頁用)，archived_count 是其中已封存的筆數
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_order_counts (
+            username TEXT PRIMARY KEY,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            archived_count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    _rebuild_user_order_counts(c)
+
+def _migration_product_pairs(c):
+    # 「買了這個的人也買了」：同一筆訂單內出現的商品對 (雙向各存一列) 與共同出現的訂單數
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS product_pairs (
+            product_id INTEGER NOT NULL,
+            other_id INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (product_id, other_id)
+        ) WITHOUT ROWID
+    ''')
+    # 依次數排好的前 k 名直接走索引，不用排序
+    c.execute("CREATE INDEX IF NOT EXISTS idx_product_pairs_top ON product_pairs (product_id, count DESC)")
+    _rebuild_product_pairs(c)
+
+def _migration_product_stock(c):
+    # 庫存：NULL 表示不追蹤 (不限量)，既有商品維持原本的行為
+    if "stock" not in [row[1] for row in c.execute("PRAGMA table_info(products)")]:
+        c.execute("ALTER TABLE products ADD COLUMN stock INTEGER")
+
+def _migration_product_images(c):
+    # 本地圖片 (見 image_store.py)：image_key 是內容雜湊檔名，NULL 表示還沒收進本地，卡片沿用 image 網址
+    if "image_key" not in [row[1] for row in c.execute("PRAGMA table_info(products)")]:
+        c.execute("ALTER TABLE products ADD COLUMN image_key TEXT")
+
+def _migration_catalog_state(c):
+    # 商品目錄的變更計數：products 有任何異動 (不論是哪個 process、有沒有排發佈) 都由觸發器加一，
+    # 目錄快照記下發佈時的計數，init_db() 比對兩者就知道快照是否落後 (見 publish_catalog_snapshot)
+    c.execute("CREATE TABLE IF NOT EXISTS catalog_state (version INTEGER NOT NULL)")
+    if c.execute("SELECT COUNT(*) FROM catalog_state").fetchone()[0] == 0:
+        c.execute("INSERT INTO catalog_state (version) VALUES (0)")
+    for name, event in (("insert", "INSERT"), ("delete", "DELETE"),
+                        ("update", "UPDATE OF name, category, price, image, stock, image_key")):
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS catalog_state_{name} AFTER {event} ON products BEGIN
+                UPDATE catalog_state SET version = version + 1;
+            END
+        ''')
+
+def _migration_order_closed_at(c):
+    # 結案時間：封存看的是「結案多久」而不是「下單多久」，由 write_status_update(s) 在狀態改變時記錄
+    for table in ("orders", "orders_archive"):
+        if "closed_at" not in [row[1] for row in c.execute(f"PRAGMA table_info({table})")]:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN closed_at TEXT")
+    # 既有的結案訂單不知道實際結案時間，以遷移當下為準 (寧可晚一點封存，也不要搬走剛結案的訂單)
+    marks = ",".join("?" * len(CLOSED_STATUSES))
+    c.execute(f"UPDATE orders SET closed_at = ? WHERE status IN ({marks}) AND closed_at IS NULL",
+              (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), *CLOSED_STATUSES))
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_closed_at ON orders (closed_at)")
+
+MIGRATIONS = [
+    _migration_base_schema,
+    _migration_analytics,
+    _migration_order_items,
+    _migration_order_indexes,
+    _migration_product_indexes,
+    _migration_product_search,
+    _migration_carts,
+    _migration_promotions,
+    _migration_orders_archive,
+    _migration_user_order_counts,
+    _migration_product_pairs,
+    _migration_product_stock,
+    _migration_product_images,
+    _migration_catalog_state,
+    _migration_order_closed_at,
+]
+
+_db_ready = False
+_init_lock = threading.Lock()
+
+@perf.timed
+def migrate():
+    """套用尚未執行的遷移，回傳 (原本版本, 目前版本)"""
+    with get_conn() as conn:
+        start = conn.execute("PRAGMA user_version").fetchone()[0]
+    version = start
+    for target, step in enumerate(MIGRATIONS, start=1):
+        if target <= version:
+            continue
+        with transaction() as conn:
+            c = conn.cursor()
+            # 拿到寫入鎖後再確認一次，避免多個 process 同時遷移
+            version = c.execute("PRAGMA user_version").fetchone()[0]
+            if target <= version:
+                continue
+            step(c)
+            c.execute(f"PRAGMA user_version = {target}")
+            version = target
+    if version != start:
+        # 遷移可能動到商品資料 (例如初始商品)，讓商品快取重新讀取
+        bump_catalog_version()
+        with get_conn() as conn:
+            conn.execute("PRAGMA optimize")
+    return start, version
+
+def init_db():
+    """確保資料庫 schema 是最新版本；同一個 process 只會真正檢查一次，之後的 rerun 直接返回"""
+    global _db_ready
+    if _db_ready:
+        return
+    with _init_lock:
+        if not _db_ready:
+            migrate()
+            # 還沒有快照、或快照落後於資料庫 (例如別的程式改了商品卻沒發佈) 才從資料庫重建，
+            # 否則直接對應現有的快照；遷移剛排了背景發佈的話就交給背景執行緒
+            if SNAPSHOT_ENABLED and _snapshot_published == _snapshot_requested:
+                snapshot = _get_snapshot_reader().snapshot()
+                if snapshot is None or snapshot.source_version != get_catalog_source_version():
+                    publish_catalog_snapshot()
+            _db_ready = True
+
+# 熱門查詢清單；check_query_plans() 用 EXPLAIN QUERY PLAN 確認它們都有走索引
+HOT_QUERIES = {
+    "check_login": ("SELECT 1 FROM users WHERE username = ? AND password = ?", ("u", "p")),
+    "get_user_orders": ("SELECT * FROM orders WHERE username = ? ORDER BY id DESC", ("u",)),
+    "orders_page": ("SELECT * FROM orders WHERE id < ? ORDER BY id DESC LIMIT ?", (100, 20)),
+    "orders_page_by_status": ("SELECT * FROM orders WHERE status = ? AND id < ? ORDER BY id DESC LIMIT ?", ("處理中", 100, 20)),
+    "orders_page_by_date": ("SELECT * FROM orders WHERE order_date >= ? AND order_date < date(?, '+1 day') ORDER BY id DESC LIMIT ?",
+                            ("2025-01-01", "2025-01-31", 20)),
+    "orders_page_by_user": ("SELECT * FROM orders WHERE username = ? AND id < ? ORDER BY id DESC LIMIT ?", ("u", 100, 20)),
+    "get_order_items": ("SELECT * FROM order_items WHERE order_id = ?", (1,)),
+    "user_order_summaries": ("SELECT id, order_date, total_amount, status FROM orders WHERE username = ? AND id < ? "
+                             "ORDER BY id DESC LIMIT ?", ("u", 100, 10)),
+    "archived_orders_by_user": ("SELECT * FROM orders_archive WHERE username = ? AND id < ? ORDER BY id DESC LIMIT ?", ("u", 100, 20)),
+    # 與 archive_orders() 實際執行的查詢相同
+    "archive_candidates": ("SELECT id FROM orders WHERE closed_at < ? LIMIT ?", ("2025-01-01", 500)),
+    "also_bought": ("SELECT other_id, count FROM product_pairs WHERE product_id = ? ORDER BY count DESC LIMIT ?", (1, 4)),
+    "products_page": ("SELECT * FROM products WHERE id > ? ORDER BY id LIMIT ?", (0, 12)),
+    "products_page_by_category": ("SELECT * FROM products WHERE category = ? AND id > ? ORDER BY id LIMIT ?", ("玩具", 0, 12)),
+}
+
+@perf.timed
+def check_query_plans():
+    """
+    檢查 HOT_QUERIES 的執行計畫，任何一個出現 SCAN (全表 / 全索引掃描) 就丟出 AssertionError。
+    回傳 {查詢名稱: [計畫描述, ...]}。
+    計畫在沒有統計資料的空 schema 複本上產生：資料很少時 ANALYZE 的統計會讓 SQLite 合理地選擇全表掃描，
+    這裡要確認的是「有可用的索引」，不受目前資料量影響。
+    """
+    with get_conn() as conn:
+        # 全文檢索的虛擬表與其內部表不在熱門查詢內，略過
+        schema = [row[0] for row in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type IN ('table', 'index') AND sql IS NOT NULL "
+            "AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'products_fts%'")]
+    plans = {}
+    probe = sqlite3.connect(":memory:")
+    try:
+        for sql in schema:
+            probe.execute(sql)
+        for name, (sql, params) in HOT_QUERIES.items():
+            plans[name] = [row[3] for row in probe.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    finally:
+        probe.close()
+    scans = {name: plan for name, plan in plans.items() if any(step.startswith("SCAN") for step in plan)}
+    if scans:
+        raise AssertionError(f"熱門查詢出現全表掃描：{scans}")
+    return plans
 
 # ==========================================
 # 使用者相關功能
 # ==========================================
+@perf.timed
 def register_user(username, password, email, real_name, address):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
     try:
-        c.execute('INSERT INTO users VALUES (?, ?, ?, ?, ?)', 
-                  (username, password, email, real_name, address))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute('INSERT INTO users VALUES (?, ?, ?, ?, ?)', 
+                         (username, password, email, real_name, address))
         return True
-    except:
+    except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
+@perf.timed
 def check_login(username, password):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('SELECT * FROM users WHERE username = ? AND password = ?', (username, password))
-    user = c.fetchone()
-    conn.close()
+    with get_conn() as conn:
+        user = conn.execute('SELECT 1 FROM users WHERE username = ? AND password = ?', (username, password)).fetchone()
     return user is not None
 
+@perf.timed
 def get_user_info(username):
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT * FROM users WHERE username = ?", conn, params=(username,))
-    conn.close()
-    if not df.empty:
-        return df.iloc[0].to_dict()
-    return None
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        row = cur.execute("SELECT username, email, real_name, address FROM users WHERE username = ?", (username,)).fetchone()
+    return dict(row) if row else None
+
+# 會員資料快取 (LRU + TTL)：結帳等畫面重跑時不用每次查 users
+PROFILE_CACHE_SIZE = 1024
+PROFILE_TTL_SEC = 300
+_profile_lock = threading.Lock()
+_profile_cache = OrderedDict()   # username -> (到期時間, 資料)
+
+@perf.timed
+def get_user_profile(username):
+    """取得會員資料 (不含密碼)，優先從快取讀取"""
+    now = time.monotonic()
+    with _profile_lock:
+        entry = _profile_cache.get(username)
+        if entry and entry[0] > now:
+            _profile_cache.move_to_end(username)
+            return entry[1]
+    profile = get_user_info(username)
+    if profile is not None:
+        with _profile_lock:
+            _profile_cache[username] = (now + PROFILE_TTL_SEC, profile)
+            _profile_cache.move_to_end(username)
+            while len(_profile_cache) > PROFILE_CACHE_SIZE:
+                _profile_cache.popitem(last=False)
+    return profile
+
+def invalidate_user_profile(username):
+    with _profile_lock:
+        _profile_cache.pop(username, None)
+
+@perf.timed
+def update_user_profile(username, email, real_name, address):
+    with transaction() as conn:
+        conn.execute("UPDATE users SET email = ?, real_name = ?, address = ? WHERE username = ?",
+                     (email, real_name, address, username))
+    invalidate_user_profile(username)
+
+# ==========================================
+# 會員購物車
+# ==========================================
+@perf.timed
+def load_cart(username):
+    """回傳 {商品編號: 數量}"""
+    with get_conn() as conn:
+        return dict(conn.execute("SELECT product_id, quantity FROM carts WHERE username = ?", (username,)).fetchall())
+
+@perf.timed
+def save_carts(carts):
+    """一次交易寫入多位會員的購物車，carts 是 {username: {商品編號: 數量}} (空的 dict 代表清空)"""
+    with transaction() as conn:
+        conn.executemany("DELETE FROM carts WHERE username = ?", [(username,) for username in carts])
+        conn.executemany("INSERT INTO carts (username, product_id, quantity) VALUES (?, ?, ?)",
+                         [(username, int(pid), int(qty)) for username, cart in carts.items()
+                          for pid, qty in cart.items() if qty > 0])
 
 # ==========================================
 # 商品讀取與管理功能
 # ==========================================
+@perf.timed
 def get_all_products():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT * FROM products", conn)
-    conn.close()
-    return df
+    with get_conn() as conn:
+        return pd.read_sql_query("SELECT * FROM products", conn)
+
+@perf.timed
+def get_products_by_ids(ids):
+    """
+    批次查詢多個商品，回傳 {id: {"id", "name", "category", "price", "image", "stock", "image_key"}}。
+    有目錄快照時直接在快照裡二分搜尋；否則每個商品個別放進商品快取，快取沒有的才用一次 IN 查詢補齊。
+    已刪除的商品不會出現在結果中。
+    """
+    snapshot = get_catalog_snapshot()
+    if snapshot is not None:
+        found = {}
+        for product_id in map(int, ids):
+            product = snapshot.get(product_id)
+            if product is not None:
+                found[product_id] = product
+        return found
+
+    found, missing = {}, []
+    with _catalog_lock:
+        for product_id in map(int, ids):
+            key = ("product", product_id)
+            if key in _catalog_cache:
+                found[product_id] = _catalog_cache[key]
+            else:
+                missing.append(product_id)
+        _catalog_stats["misses" if missing else "hits"] += 1
+        version = _catalog_version
+    if not missing:
+        return found
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        cur.execute(f"SELECT id, name, category, price, image, stock, image_key FROM products WHERE id IN ({','.join('?' * len(missing))})", missing)
+        loaded = {row["id"]: dict(row) for row in cur}
+    with _catalog_lock:
+        if version == _catalog_version:
+            for product_id, product in loaded.items():
+                _catalog_cache[("product", product_id)] = product
+    found.update(loaded)
+    return found
+
+@perf.timed
+def get_product_categories():
+    """所有分類 (依第一次出現的商品順序)，走商品快取"""
+    def load():
+        snapshot = get_catalog_snapshot()
+        if snapshot is not None:
+            return snapshot.categories()
+        with get_conn() as conn:
+            return [row[0] for row in conn.execute("SELECT category FROM products GROUP BY category ORDER BY MIN(id)")]
+    return _catalog_cached(("categories",), load)
+
+@perf.timed
+def get_products_page(category=None, after_id=None, page_size=12):
+    """
+    Keyset 分頁：依 id 由小到大取出 id > after_id 的一頁商品 (可指定分類)。
+    回傳 (DataFrame, 是否還有下一頁)，結果放在商品快取裡。
+    """
+    def load():
+        sql = "SELECT * FROM products WHERE id > ? ORDER BY id LIMIT ?"
+        params = (after_id or 0, page_size + 1)
+        if category:
+            sql = "SELECT * FROM products WHERE category = ? AND id > ? ORDER BY id LIMIT ?"
+            params = (category, *params)
+        with get_conn() as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+        return df.head(page_size), len(df) > page_size
+    return _catalog_cached(("page", category, after_id, page_size), load)
+
+# ==========================================
+# 商品搜尋 (FTS5)
+# ==========================================
+_CJK_CHAR = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]")
+_SEARCH_TOKEN = re.compile(r"[^\W_]+")
+
+def fts_segment(text):
+    """把中日韓文字拆成一字一個 token，英數字維持原樣 (寫入 FTS 索引前使用)"""
+    return _CJK_CHAR.sub(r" \g<0> ", text or "")
+
+def _fts_query(query):
+    """
+    把使用者輸入轉成 FTS5 查詢：每個詞變成一個片語，最後一個 token 做前綴比對，
+    多個詞之間是 AND。例如「type 集線」→ "type" * AND "集 線" *
+    """
+    phrases = []
+    for term in (query or "").split():
+        tokens = _SEARCH_TOKEN.findall(fts_segment(term))
+        if tokens:
+            phrases.append(f'"{" ".join(tokens)}" *')
+    return " AND ".join(phrases)
 
-def add_new_product(name, category, price, image_url):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+@perf.timed
+def search_products(query, category=None, limit=24):
+    """全文搜尋商品名稱與分類，依相關度排序 (名稱的權重比分類高)；沒有可搜尋的字就回傳空表"""
+    match = _fts_query(query)
+    sql = '''SELECT p.* FROM products_fts f JOIN products p ON p.id = f.rowid
+             WHERE products_fts MATCH ?{category} ORDER BY bm25(products_fts, 10.0, 1.0) LIMIT ?'''
+    params = [match]
+    if category:
+        params.append(category)
+    params.append(limit)
+    with get_conn() as conn:
+        if not match:
+            return pd.read_sql_query("SELECT * FROM products WHERE 0", conn)
+        return pd.read_sql_query(sql.format(category=" AND p.category = ?" if category else ""), conn, params=params)
+
+@perf.timed
+def add_new_product(name, category, price, image_url, stock=None, image_key=None):
     try:
-        c.execute('INSERT INTO products (name, category, price, image) VALUES (?, ?, ?, ?)', 
-                  (name, category, price, image_url))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute('INSERT INTO products (name, category, price, image, stock, image_key) VALUES (?, ?, ?, ?, ?, ?)', 
+                         (name, category, price, image_url, stock, image_key))
+        bump_catalog_version()
         return True
     except Exception as e:
         print(e)
         return False
-    finally:
-        conn.close()
+
+@perf.timed
+def upsert_products(conn, rows):
+    """
+    在呼叫端的交易內批次寫入商品，rows 是 [(id 或 None, name, category, price, image, image_key), ...]。
+    有 id 的依 id 新增或覆蓋，沒有 id 的直接新增。呼叫端 commit 後要自己 bump_catalog_version()。
+    覆蓋時 image_key 給 NULL 代表「沒有新的本地圖片」：圖片網址沒變就保留原本的本地圖片，網址換了才清掉。
+    """
+    with_id = [r for r in rows if r[0] is not None]
+    without_id = [r[1:] for r in rows if r[0] is None]
+    conn.executemany('''INSERT INTO products (id, name, category, price, image, image_key) VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(id) DO UPDATE SET name = excluded.name, category = excluded.category,
+                                                      price = excluded.price, image = excluded.image,
+                                                      image_key = CASE WHEN excluded.image_key IS NOT NULL THEN excluded.image_key
+                                                                       WHEN excluded.image = products.image THEN products.image_key END''',
+                     with_id)
+    conn.executemany("INSERT INTO products (name, category, price, image, image_key) VALUES (?, ?, ?, ?, ?)", without_id)
+
+def iter_products(chunk_size=1000):
+    """依 id 逐批讀出商品 (tuple)，每批是獨立的短查詢，不會長時間佔著讀取交易"""
+    last_id = 0
+    while True:
+        with get_conn() as conn:
+            rows = conn.execute("SELECT id, name, category, price, image, image_key FROM products WHERE id > ? ORDER BY id LIMIT ?",
+                                (last_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1][0]
 
 # ==========================================
 # 訂單相關功能 (更新版)
 # ==========================================
-def save_order_to_db(username, name, email, address, total, original, discount, items):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+@perf.timed
+def write_order(conn, username, name, email, address, total, original, discount, items, line_items=(), promotion_id=None):
+    """
+    在呼叫端已開啟的交易內寫入一筆訂單 (主檔 + 明細 + 統計表)，回傳訂單編號。
+    items 是給人看的商品摘要文字；line_items 是 [(product_id, 單價, 數量), ...]。
+    有 promotion_id 時會同時占用一次該促銷的使用次數，額滿則丟出 PromotionUnavailableError。
+    有追蹤庫存的商品會在同一個交易內扣庫存，不足則丟出 OutOfStockError。
+    commit 之後要呼叫 flush_catalog_changes(conn) (有商品售完時讓商品快取失效)。
+    """
     date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # 先扣庫存：不足就丟出 OutOfStockError，整筆訂單 (含已扣的其他品項) 由呼叫端 rollback
+    _reserve_stock(conn, line_items)
+    if promotion_id is not None:
+        _use_promotion(conn, promotion_id, date)
     
     # 這裡的欄位順序要跟 INSERT 對應
-    c.execute('''INSERT INTO orders (order_date, username, customer_name, customer_email, 
-                 customer_address, total_amount, original_amount, discount, items_summary, status) 
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
-              (date, username, name, email, address, total, original, discount, items, "處理中"))
-    conn.commit()
-    conn.close()
-
-def get_all_orders():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT * FROM orders ORDER BY id DESC", conn)
-    conn.close()
+    cur = conn.execute('''INSERT INTO orders (order_date, username, customer_name, customer_email, 
+                          customer_address, total_amount, original_amount, discount, items_summary, status, promotion_id) 
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
+                       (date, username, name, email, address, total, original, discount, items, "處理中", promotion_id))
+    order_id = cur.lastrowid
+    conn.executemany("INSERT INTO order_items (order_id, product_id, unit_price, quantity) VALUES (?, ?, ?, ?)",
+                     [(order_id, int(pid), int(price), int(qty)) for pid, price, qty in line_items])
+    _add_daily_sales(conn, date, total)
+    _add_status_count(conn, "處理中", 1)
+    _add_user_order_count(conn, username, 1)
+    _add_product_pairs(conn, [pid for pid, _, _ in line_items])
+    return order_id
+
+@perf.timed
+def save_order_to_db(username, name, email, address, total, original, discount, items, line_items=(), promotion_id=None):
+    """同步寫入一筆訂單 (自己一個交易)，回傳訂單編號；結帳流程改走 order_writer 的批次寫入"""
+    with transaction() as conn:
+        order_id = write_order(conn, username, name, email, address, total, original, discount, items, line_items, promotion_id)
+    flush_catalog_changes(conn)
+    return order_id
+
+def _merge_archived(hot, cold, limit=None):
+    """合併熱 / 冷兩份訂單 (各自已依 id 由新到舊排序)，加上 archived 欄位"""
+    hot = hot.assign(archived=False)
+    cold = cold.assign(archived=True)
+    if cold.empty:
+        df = hot
+    elif hot.empty:
+        df = cold
+    else:
+        df = pd.concat([hot, cold], ignore_index=True).sort_values("id", ascending=False, ignore_index=True)
+    return df if limit is None else df.head(limit)
+
+@perf.timed
+def get_all_orders(include_archived=False):
+    with get_conn() as conn:
+        df = pd.read_sql_query("SELECT * FROM orders ORDER BY id DESC", conn)
+        if include_archived:
+            df = _merge_archived(df, pd.read_sql_query(f"SELECT {ORDER_COLUMNS} FROM orders_archive ORDER BY id DESC", conn))
     return df
 
-def get_user_orders(username):
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT * FROM orders WHERE username = ? ORDER BY id DESC", conn, params=(username,))
-    conn.close()
+@perf.timed
+def get_user_orders(username, include_archived=False):
+    with get_conn() as conn:
+        df = pd.read_sql_query("SELECT * FROM orders WHERE username = ? ORDER BY id DESC", conn, params=(username,))
+        if include_archived:
+            df = _merge_archived(df, pd.read_sql_query(f"SELECT {ORDER_COLUMNS} FROM orders_archive WHERE username = ? ORDER BY id DESC",
+                                                       conn, params=(username,)))
     return df
 
+@perf.timed
+def get_user_order_count(username):
+    """(全部訂單數, 其中已封存的筆數)，直接讀彙總表"""
+    with get_conn() as conn:
+        row = conn.execute("SELECT order_count, archived_count FROM user_order_counts WHERE username = ?",
+                           (username,)).fetchone()
+    return tuple(row) if row else (0, 0)
+
+ORDER_SUMMARY_COLUMNS = "id, order_date, total_amount, status"
+
+@perf.timed
+def get_user_order_summaries(username, before_id=None, page_size=10, include_archived=False):
+    """
+    會員中心用的 keyset 分頁：只取摘要欄位，依 id 由新到舊取 id < before_id 的一頁。
+    回傳 (DataFrame, 是否還有下一頁)；明細用 get_order_detail() 另外讀。
+    """
+    before_id = 2 ** 63 - 1 if before_id is None else int(before_id)
+    sql = "SELECT {cols} FROM {table} WHERE username = ? AND id < ? ORDER BY id DESC LIMIT ?"
+    params = (username, before_id, page_size + 1)
+    with get_conn() as conn:
+        df = pd.read_sql_query(sql.format(cols=ORDER_SUMMARY_COLUMNS, table="orders"), conn, params=params)
+        if include_archived:
+            cold = pd.read_sql_query(sql.format(cols=ORDER_SUMMARY_COLUMNS, table="orders_archive"), conn, params=params)
+            df = _merge_archived(df, cold, page_size + 1)
+    return df.head(page_size), len(df) > page_size
+
+@perf.timed
+def get_order_detail(order_id, username=None):
+    """讀一筆訂單的完整欄位 (先找訂單表再找封存表)；給 username 時只回傳該會員的訂單"""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        for table in ("orders", "orders_archive"):
+            row = cur.execute(f"SELECT {ORDER_COLUMNS} FROM {table} WHERE id = ?", (int(order_id),)).fetchone()
+            if row is not None:
+                return dict(row) if username is None or row["username"] == username else None
+    return None
+
+def _order_filters(status=None, date_from=None, date_to=None, username=None, customer_name=None):
+    """把篩選條件組成 WHERE 子句 (date_to 含當天)"""
+    clauses, params = [], []
+    if status:
+        clauses.append("status = ?"); params.append(status)
+    if date_from:
+        clauses.append("order_date >= ?"); params.append(str(date_from))
+    if date_to:
+        clauses.append("order_date < date(?, '+1 day')"); params.append(str(date_to))
+    if username:
+        clauses.append("username = ?"); params.append(username)
+    if customer_name:
+        clauses.append("customer_name LIKE ?"); params.append(f"%{customer_name}%")
+    return clauses, params
+
+def iter_orders(chunk_size=1000, include_archived=False, **filters):
+    """
+    依 id 逐批讀出訂單 (tuple，欄位順序同 ORDER_COLUMNS)，每批是獨立的短查詢，
+    不會長時間佔著讀取交易擋住結帳。include_archived=True 時先讀封存表再讀訂單表。
+    """
+    tables = ("orders_archive", "orders") if include_archived else ("orders",)
+    for table in tables:
+        last_id = 0
+        while True:
+            clauses, params = _order_filters(**filters)
+            clauses.append("id > ?"); params.append(last_id)
+            with get_conn() as conn:
+                rows = conn.execute(f"SELECT {ORDER_COLUMNS} FROM {table} WHERE {' AND '.join(clauses)} "
+                                    f"ORDER BY id LIMIT ?", (*params, chunk_size)).fetchall()
+            if not rows:
+                break
+            yield from rows
+            last_id = rows[-1][0]
+
+@perf.timed
+def get_order_items(order_id):
+    with get_conn() as conn:
+        return pd.read_sql_query('''SELECT oi.product_id, p.name, p.category, oi.unit_price, oi.quantity
+                                    FROM order_items oi LEFT JOIN products p ON p.id = oi.product_id
+                                    WHERE oi.order_id = ?''', conn, params=(order_id,))
+
+@perf.timed
+def count_orders(**filters):
+    """符合篩選條件的訂單數 (只算訂單表，不含封存)"""
+    clauses, params = _order_filters(**filters)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    with get_conn() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM orders{where}", params).fetchone()[0]
+
+@perf.timed
+def get_orders_page(before_id=None, page_size=20, include_archived=False, **filters):
+    """
+    Keyset 分頁：依 id 由新到舊取出 id < before_id 的一頁訂單。
+    回傳 (DataFrame, 是否還有下一頁)，查詢成本只跟 page_size 有關。
+    include_archived=True 時兩張表各取一頁再合併 (多一個 archived 欄位)。
+    """
+    clauses, params = _order_filters(**filters)
+    if before_id is not None:
+        clauses.append("id < ?"); params.append(int(before_id))
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    with get_conn() as conn:
+        # 多抓一筆，用來判斷是否還有下一頁
+        df = pd.read_sql_query(f"SELECT * FROM orders{where} ORDER BY id DESC LIMIT ?", conn,
+                               params=(*params, page_size + 1))
+        if include_archived:
+            cold = pd.read_sql_query(f"SELECT {ORDER_COLUMNS} FROM orders_archive{where} ORDER BY id DESC LIMIT ?", conn,
+                                     params=(*params, page_size + 1))
+            df = _merge_archived(df, cold, page_size + 1)
+    return df.head(page_size), len(df) > page_size
+
+@perf.timed
+def write_status_update(conn, order_id, new_status):
+    """在呼叫端已開啟的交易內更新訂單狀態，並同步調整狀態統計"""
+    row = conn.execute("SELECT status FROM orders WHERE id = ?", (order_id,)).fetchone()
+    if row is None or row[0] == new_status:
+        return
+    conn.execute("UPDATE orders SET status = ?, closed_at = ? WHERE id = ?", (new_status, _closed_at(new_status), order_id))
+    _add_status_count(conn, row[0], -1)
+    _add_status_count(conn, new_status, 1)
+
+@perf.timed
 def update_order_status(order_id, new_status):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("UPDATE orders SET status = ? WHERE id = ?", (new_status, order_id))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    with transaction() as conn:
+        write_status_update(conn, order_id, new_status)
+
+# 一次 UPDATE 的 id 數量上限 (SQLite 的參數個數有上限)
+STATUS_UPDATE_CHUNK = 500
+
+@perf.timed
+def write_status_updates(conn, order_ids, new_status):
+    """
+    在呼叫端已開啟的交易內把多筆訂單改成同一個狀態，回傳實際變更的筆數。
+    狀態統計依每種舊狀態的筆數一次調整；已是 new_status 或不在 orders 表 (已封存) 的訂單略過。
+    """
+    ids = sorted({int(i) for i in order_ids})
+    changed = {}
+    for start in range(0, len(ids), STATUS_UPDATE_CHUNK):
+        chunk = ids[start:start + STATUS_UPDATE_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        for status, count in conn.execute(f"SELECT status, COUNT(*) FROM orders WHERE id IN ({marks}) AND status != ? "
+                                          f"GROUP BY status", (*chunk, new_status)):
+            changed[status] = changed.get(status, 0) + count
+        conn.execute(f"UPDATE orders SET status = ?, closed_at = ? WHERE id IN ({marks}) AND status != ?",
+                     (new_status, _closed_at(new_status), *chunk, new_status))
+    for status, count in changed.items():
+        _add_status_count(conn, status, -count)
+    total = sum(changed.values())
+    if total:
+        _add_status_count(conn, new_status, total)
+    return total
+
+@perf.timed
+def update_order_statuses(order_ids, new_status):
+    """批次更新訂單狀態 (一個交易、一次 commit)，回傳實際變更的筆數"""
+    with transaction() as conn:
+        return write_status_updates(conn, order_ids, new_status)
+
+# ==========================================
+# 訂單封存 (熱 / 冷分離)
+# ==========================================
+# 結案 (已完成 / 取消) 超過 ARCHIVE_AFTER_DAYS 天的訂單搬到 orders_archive，天數從結案時間 closed_at 起算；
+# 營運統計表是全期累計，封存不影響。明細 order_items 依訂單編號保留不動。
+CLOSED_STATUSES = ("已完成", "取消")
+
+def _closed_at(new_status):
+    # 改成結案狀態就記下現在的時間 (已完成 → 取消 也算重新結案)；改回進行中的狀態則清掉
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S") if new_status in CLOSED_STATUSES else None
+ARCHIVE_AFTER_DAYS = int(os.environ.get("SHOP_ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = 500
+
+@perf.timed
+def archive_orders(older_than_days=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    把結案 (closed_at) 超過 older_than_days 天的訂單搬進 orders_archive，回傳搬移筆數。
+    每批一個短交易，不會長時間占住寫入鎖。
+    """
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    now = datetime.now()
+    cutoff = datetime.fromtimestamp(now.timestamp() - days * 86400).strftime("%Y-%m-%d %H:%M:%S")
+    archived_at = now.strftime("%Y-%m-%d %H:%M:%S")
+    moved = 0
+    while True:
+        with transaction() as conn:
+            # 只有結案的訂單有 closed_at (見 write_status_update)
+            ids = [row[0] for row in conn.execute("SELECT id FROM orders WHERE closed_at < ? LIMIT ?", (cutoff, batch_size))]
+            if not ids:
+                break
+            id_marks = ",".join("?" * len(ids))
+            for username, count in conn.execute(f"SELECT username, COUNT(*) FROM orders WHERE id IN ({id_marks}) "
+                                                f"GROUP BY username", ids).fetchall():
+                _add_user_order_count(conn, username, 0, count)
+            conn.execute(f"""INSERT INTO orders_archive ({ORDER_COLUMNS}, closed_at, archived_at)
+                             SELECT {ORDER_COLUMNS}, closed_at, ? FROM orders WHERE id IN ({id_marks})""", (archived_at, *ids))
+            conn.execute(f"DELETE FROM orders WHERE id IN ({id_marks})", ids)
+        moved += len(ids)
+    return moved
+
+@perf.timed
+def get_archive_stats():
+    """(熱表筆數, 封存筆數)"""
+    with get_conn() as conn:
+        hot = conn.execute("SELECT count(*) FROM orders").fetchone()[0]
+        cold = conn.execute("SELECT count(*) FROM orders_archive").fetchone()[0]
+    return hot, cold
+
+# ==========================================
+# 庫存
+# ==========================================
+class OutOfStockError(Exception):
+    """下單時庫存不足；items 是 [(商品編號, 要買的數量, 目前庫存), ...]"""
+    def __init__(self, items):
+        super().__init__(f"庫存不足：{items}")
+        self.items = items
+
+def _reserve_stock(conn, line_items):
+    """
+    在呼叫端的交易內逐項做條件式扣庫存 (stock >= 數量 才扣)，不需要先讀再寫，也不會超賣。
+    不追蹤庫存 (stock 為 NULL) 的商品直接通過；有商品扣到 0 時標記目錄快取待失效。
+    """
+    shortages = []
+    for product_id, _, quantity in line_items:
+        row = conn.execute("UPDATE products SET stock = stock - ? WHERE id = ? AND (stock IS NULL OR stock >= ?) "
+                           "RETURNING stock", (int(quantity), int(product_id), int(quantity))).fetchone()
+        if row is None:
+            left = conn.execute("SELECT stock FROM products WHERE id = ?", (int(product_id),)).fetchone()
+            shortages.append((int(product_id), int(quantity), left[0] if left else 0))
+        elif row[0] == 0:
+            _mark_catalog_dirty(conn)
+    if shortages:
+        raise OutOfStockError(shortages)
+
+@perf.timed
+def set_product_stock(product_id, stock):
+    """設定商品庫存 (補貨 / 盤點)；stock=None 表示不追蹤庫存"""
+    with transaction() as conn:
+        conn.execute("UPDATE products SET stock = ? WHERE id = ?", (stock, int(product_id)))
+    bump_catalog_version()
+
+@perf.timed
+def set_product_image_keys(pairs):
+    """批次設定商品的本地圖片，pairs 是 [(product_id, image_key), ...] (補收舊商品圖片用)"""
+    with transaction() as conn:
+        conn.executemany("UPDATE products SET image_key = ? WHERE id = ?", [(key, int(pid)) for pid, key in pairs])
+    bump_catalog_version()
+
+# ==========================================
+# 促銷活動
+# ==========================================
+class PromotionUnavailableError(Exception):
+    """下單時促銷已停用、過期或使用次數額滿"""
+
+_promotions_version = 0
+
+def get_promotions_version():
+    return _promotions_version
+
+def _bump_promotions_version():
+    global _promotions_version
+    _promotions_version += 1
+
+def _use_promotion(conn, promotion_id, now):
+    # 條件式累加：兩個人同時搶最後一次名額時只有一個會成功
+    row = conn.execute('''UPDATE promotions SET used_count = used_count + 1
+                          WHERE id = ? AND active = 1
+                            AND (usage_limit IS NULL OR used_count < usage_limit)
+                            AND (starts_at IS NULL OR starts_at <= ?)
+                            AND (ends_at IS NULL OR ends_at > ?)
+                          RETURNING usage_limit IS NOT NULL AND used_count >= usage_limit''',
+                       (promotion_id, now, now)).fetchone()
+    if row is None:
+        # 定價引擎手上的規則已經過期 (名額被別的 process 用完、被停用...)：立刻重新編譯，
+        # 否則自動套用的活動會一直被報價、一直下單失敗
+        _bump_promotions_version()
+        raise PromotionUnavailableError(f"促銷 #{promotion_id} 已無法使用")
+    if row[0]:
+        # 用掉最後一個名額：commit 之後才讓定價規則重新編譯 (見 flush_catalog_changes)
+        _mark_promotions_dirty(conn)
+
+@perf.timed
+def load_active_promotions():
+    """給定價引擎編譯用：所有啟用中且還有名額的促銷 (不含時間判斷，由引擎處理)"""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        cur.execute('''SELECT id, name, code, kind, value, scope, target, min_spend, starts_at, ends_at
+                       FROM promotions WHERE active = 1 AND (usage_limit IS NULL OR used_count < usage_limit)''')
+        return [dict(row) for row in cur]
+
+@perf.timed
+def get_promotions():
+    with get_conn() as conn:
+        return pd.read_sql_query("SELECT * FROM promotions ORDER BY id DESC", conn)
+
+@perf.timed
+def add_promotion(name, kind, value, scope="all", target=None, code=None, min_spend=0,
+                  starts_at=None, ends_at=None, usage_limit=None):
+    if kind == "percent" and not 0 < int(value) <= 100:
+        raise ValueError("百分比折扣必須介於 1 到 100 之間")
+    with transaction() as conn:
+        cur = conn.execute('''INSERT INTO promotions (name, code, kind, value, scope, target, min_spend,
+                                                        starts_at, ends_at, usage_limit)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                           (name, code.strip().upper() if code else None, kind, value, scope,
+                            None if target is None else str(target), min_spend, starts_at, ends_at, usage_limit))
+    _bump_promotions_version()
+    return cur.lastrowid
+
+@perf.timed
+def set_promotion_active(promotion_id, active):
+    with transaction() as conn:
+        conn.execute("UPDATE promotions SET active = ? WHERE id = ?", (1 if active else 0, promotion_id))
+    _bump_promotions_version()
+
+# ==========================================
+# 推薦：一起購買的商品 (product_pairs 共現索引)
+# ==========================================
+# 推薦列表每個商品最多看幾個候選
+ALSO_BOUGHT_CANDIDATES = 8
+
+def _add_product_pairs(conn, product_ids):
+    """訂單寫入時累加商品對的共現次數 (在呼叫端的交易內)"""
+    ids = sorted({int(pid) for pid in product_ids})
+    pairs = [(a, b) for a in ids for b in ids if a != b]
+    if pairs:
+        conn.executemany('''INSERT INTO product_pairs (product_id, other_id, count) VALUES (?, ?, 1)
+                            ON CONFLICT(product_id, other_id) DO UPDATE SET count = count + 1''', pairs)
+
+def _rebuild_product_pairs(c):
+    # 明細依訂單編號保留 (含已封存的訂單)，直接從 order_items 自我 join
+    c.execute("DELETE FROM product_pairs")
+    c.execute('''INSERT INTO product_pairs (product_id, other_id, count)
+                 SELECT a.product_id, b.product_id, COUNT(*) FROM order_items a
+                 JOIN order_items b ON b.order_id = a.order_id AND b.product_id != a.product_id
+                 GROUP BY a.product_id, b.product_id''')
+
+@perf.timed
+def rebuild_product_pairs():
+    """依全部訂單明細重建共現索引，回傳商品對數 (雙向各算一列)"""
+    with transaction() as conn:
+        c = conn.cursor()
+        _rebuild_product_pairs(c)
+        return c.execute("SELECT count(*) FROM product_pairs").fetchone()[0]
+
+@perf.timed
+def get_also_bought(product_ids, k=4):
+    """
+    買了 product_ids 的人也買了哪些商品，回傳最多 k 個商品 dict (同 get_products_by_ids)。
+    每個商品只讀索引上的前幾名候選，成本跟 k 和商品數有關、跟訂單歷史長度無關；
+    多個商品的候選次數相加後排序，已在 product_ids 內的商品不會出現。
+    """
+    ids = {int(pid) for pid in product_ids}
+    if not ids:
+        return []
+    scores = {}
+    with get_conn() as conn:
+        for pid in ids:
+            for other_id, count in conn.execute("SELECT other_id, count FROM product_pairs WHERE product_id = ? "
+                                                "ORDER BY count DESC LIMIT ?", (pid, max(k, ALSO_BOUGHT_CANDIDATES))):
+                if other_id not in ids:
+                    scores[other_id] = scores.get(other_id, 0) + count
+    top = sorted(scores, key=lambda i: (-scores[i], i))
+    products = get_products_by_ids(top[:k * 2])
+    return [products[i] for i in top if i in products][:k]
+
+# ==========================================
+# 訂單明細：舊資料轉換與銷售統計
+# ==========================================
+def _parse_items_summary(summary):
+    """把舊的摘要文字「降噪耳機 x2, 音響 x1」拆成 [(商品名稱, 數量), ...]"""
+    result = []
+    for part in (summary or "").split(", "):
+        name, sep, qty = part.rpartition(" x")
+        if sep and name and qty.isdigit():
+            result.append((name, int(qty)))
+    return result
+
+def _backfill_order_items(c):
+    """
+    依 items_summary 補建既有訂單的明細。
+    舊訂單沒有記錄當時單價，只能用目前的商品價格；找不到名稱的商品略過。
+    """
+    products = {name: (pid, price) for pid, name, price in c.execute("SELECT id, name, price FROM products")}
+    rows = []
+    for order_id, summary in c.execute("SELECT id, items_summary FROM orders").fetchall():
+        lines = {}
+        for name, qty in _parse_items_summary(summary):
+            if name in products:
+                pid, price = products[name]
+                lines[pid] = (price, lines.get(pid, (price, 0))[1] + qty)
+        rows.extend((order_id, pid, price, qty) for pid, (price, qty) in lines.items())
+    c.executemany("INSERT OR IGNORE INTO order_items (order_id, product_id, unit_price, quantity) VALUES (?, ?, ?, ?)", rows)
+    return len(rows)
+
+@perf.timed
+def backfill_order_items():
+    """重新解析所有舊訂單的摘要文字寫入 order_items (已存在的明細不會重複寫入)，回傳處理筆數"""
+    with transaction() as conn:
+        return _backfill_order_items(conn.cursor())
+
+@perf.timed
+def get_product_sales(limit=10):
+    """各商品銷售量與營收 (依銷售量排序)"""
+    with get_conn() as conn:
+        return pd.read_sql_query('''SELECT s.product_id, p.name, p.category, s.quantity, s.revenue
+                                    FROM (SELECT product_id, SUM(quantity) AS quantity, SUM(unit_price * quantity) AS revenue
+                                          FROM order_items GROUP BY product_id) s
+                                    LEFT JOIN products p ON p.id = s.product_id
+                                    ORDER BY s.quantity DESC LIMIT ?''', conn, params=(limit,))
+
+@perf.timed
+def get_category_sales():
+    """各分類銷售量與營收"""
+    with get_conn() as conn:
+        return pd.read_sql_query('''SELECT p.category, SUM(s.quantity) AS quantity, SUM(s.revenue) AS revenue
+                                    FROM (SELECT product_id, SUM(quantity) AS quantity, SUM(unit_price * quantity) AS revenue
+                                          FROM order_items GROUP BY product_id) s
+                                    JOIN products p ON p.id = s.product_id
+                                    GROUP BY p.category ORDER BY revenue DESC''', conn)
+
+# ==========================================
+# 營運統計 (預先彙總，儀表板只讀這兩張小表)
+# ==========================================
+def _add_daily_sales(conn, order_date, amount, count=1):
+    conn.execute('''INSERT INTO daily_sales (day, revenue, order_count) VALUES (?, ?, ?)
+                    ON CONFLICT(day) DO UPDATE SET revenue = revenue + excluded.revenue,
+                                                   order_count = order_count + excluded.order_count''',
+                 (order_date[:10], amount, count))
+
+def _add_status_count(conn, status, delta):
+    conn.execute('''INSERT INTO order_status_counts (status, order_count) VALUES (?, ?)
+                    ON CONFLICT(status) DO UPDATE SET order_count = order_count + excluded.order_count''',
+                 (status, delta))
+
+def _add_user_order_count(conn, username, delta, archived_delta=0):
+    # 沒有會員帳號的訂單 (username 是 NULL) 不計數，與 _rebuild_user_order_counts 一致
+    if username is None:
+        return
+    conn.execute('''INSERT INTO user_order_counts (username, order_count, archived_count) VALUES (?, ?, ?)
+                    ON CONFLICT(username) DO UPDATE SET order_count = order_count + excluded.order_count,
+                                                        archived_count = archived_count + excluded.archived_count''',
+                 (username, delta, archived_delta))
+
+def _rebuild_user_order_counts(c):
+    c.execute("DELETE FROM user_order_counts")
+    c.execute('''INSERT INTO user_order_counts (username, order_count, archived_count)
+                 SELECT username, COUNT(*), SUM(archived) FROM
+                     (SELECT username, 0 AS archived FROM orders
+                      UNION ALL SELECT username, 1 FROM orders_archive)
+                 WHERE username IS NOT NULL GROUP BY username''')
+
+def _rebuild_analytics(c):
+    # 統計是全期累計：有封存表時要連同封存的訂單一起算
+    source = "orders"
+    if c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'orders_archive'").fetchone():
+        source = ("(SELECT order_date, total_amount, status FROM orders "
+                  "UNION ALL SELECT order_date, total_amount, status FROM orders_archive)")
+    c.execute("DELETE FROM daily_sales")
+    c.execute("DELETE FROM order_status_counts")
+    c.execute(f'''INSERT INTO daily_sales (day, revenue, order_count)
+                  SELECT substr(order_date, 1, 10), SUM(total_amount), COUNT(*) FROM {source}
+                  GROUP BY substr(order_date, 1, 10)''')
+    c.execute(f'''INSERT INTO order_status_counts (status, order_count)
+                  SELECT status, COUNT(*) FROM {source} GROUP BY status''')
+
+@perf.timed
+def rebuild_analytics():
+    """依 orders (含封存) 全表重新計算統計表 (一次性補資料用)，回傳 (天數, 狀態數)"""
+    with transaction() as conn:
+        c = conn.cursor()
+        _rebuild_analytics(c)
+        _rebuild_user_order_counts(c)
+        days = c.execute("SELECT count(*) FROM daily_sales").fetchone()[0]
+        statuses = c.execute("SELECT count(*) FROM order_status_counts").fetchone()[0]
+    return days, statuses
+
+@perf.timed
+def get_sales_summary():
+    """回傳 (總營收, 總訂單數)"""
+    with get_conn() as conn:
+        revenue, orders = conn.execute("SELECT COALESCE(SUM(revenue), 0), COALESCE(SUM(order_count), 0) FROM daily_sales").fetchone()
+    return revenue, orders
+
+@perf.timed
+def get_daily_revenue():
+    with get_conn() as conn:
+        return pd.read_sql_query("SELECT day, revenue, order_count FROM daily_sales ORDER BY day", conn)
+
+@perf.timed
+def get_status_counts():
+    with get_conn() as conn:
+        return pd.read_sql_query("SELECT status, order_count FROM order_status_counts WHERE order_count > 0", conn)
@@ -0,0 +1,145 @@
+# image_store.py
+# 商品圖片的本地儲存：依內容雜湊命名 (相同圖片只存一份)，收進來時就先產生好縮圖，
+# 商品卡片改用 Streamlit 靜態檔案服務 (/app/static/...) 讀本地縮圖，不再直接連外部的原圖。
+#
+# 檔案結構 (static/images/，需要 .streamlit/config.toml 的 enableStaticServing = true)：
+#   <前兩碼>/<雜湊>.<原始副檔名>      原圖
+#   <前兩碼>/<雜湊>-<寬度>.<縮圖格式>  各尺寸縮圖
+# image_key 就是「<雜湊>.<原始副檔名>」，內容不變網址就不變，瀏覽器可以放心快取。
+import hashlib
+import os
+import re
+import tempfile
+import urllib.request
+
+try:  # 產生縮圖需要 Pillow；沒安裝時只存原圖，卡片直接用原圖
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+STATIC_DIR = os.environ.get("SHOP_STATIC_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+IMAGE_DIR = os.path.join(STATIC_DIR, "images")
+STATIC_URL = "/app/static/images"
+
+# 縮圖寬度 (像素)：商品卡片一欄約 300px，用 480 兼顧高解析度螢幕；160 給小圖使用
+THUMB_WIDTHS = (160, 480)
+CARD_WIDTH = 480
+THUMB_FORMAT, THUMB_EXT = ("WEBP", "webp") if Image is not None and features.check("webp") else ("JPEG", "jpg")
+THUMB_QUALITY = 80
+
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+DOWNLOAD_TIMEOUT_SEC = 10
+
+_KEY_RE = re.compile(r"^[0-9a-f]{32}\.(jpg|png|gif|webp)$")
+
+def _sniff_ext(data):
+    """依檔頭判斷圖片格式 (不需要 Pillow)，不認得的回傳 None"""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def is_image_key(key):
+    return isinstance(key, str) and _KEY_RE.match(key) is not None
+
+def _path(name):
+    return os.path.join(IMAGE_DIR, name[:2], name)
+
+def _thumb_name(key, width):
+    return f"{key.split('.')[0]}-{width}.{THUMB_EXT}"
+
+def _write_atomic(path, write):
+    # 先寫暫存檔再改名，其他 process 不會讀到寫一半的圖片
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+# ==========================================
+# 收圖
+# ==========================================
+def _make_thumbnails(key, path):
+    if Image is None:
+        return
+    missing = [w for w in THUMB_WIDTHS if not os.path.exists(_path(_thumb_name(key, w)))]
+    if not missing:
+        return
+    try:
+        with Image.open(path) as img:
+            img = ImageOps.exif_transpose(img)
+            img = img.convert("RGBA" if THUMB_FORMAT == "WEBP" and "A" in img.getbands() else "RGB")
+            for width in missing:
+                thumb = img
+                if img.width > width:  # 只縮小不放大
+                    thumb = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+                _write_atomic(_path(_thumb_name(key, width)),
+                              lambda f: thumb.save(f, THUMB_FORMAT, quality=THUMB_QUALITY))
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"圖片無法解碼：{e}") from e
+
+def ingest_bytes(data):
+    """收進一張圖片 (bytes)，回傳 image_key；同樣內容的圖片只會存一份、縮圖只產生一次"""
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ValueError(f"圖片超過 {MAX_IMAGE_BYTES // (1024 * 1024)} MB")
+    ext = _sniff_ext(data)
+    if ext is None:
+        raise ValueError("不支援的圖片格式 (只收 JPEG / PNG / GIF / WebP)")
+    key = f"{hashlib.sha256(data).hexdigest()[:32]}.{ext}"
+    path = _path(key)
+    if not os.path.exists(path):
+        _write_atomic(path, lambda f: f.write(data))
+    try:
+        _make_thumbnails(key, path)
+    except ValueError:
+        # 檔頭像圖片但內容壞掉：不留下原圖，免得之後被當成正常圖片引用
+        os.remove(path)
+        raise
+    return key
+
+def ingest_file(path):
+    with open(path, "rb") as f:
+        return ingest_bytes(f.read(MAX_IMAGE_BYTES + 1))
+
+def ingest_url(url, timeout=DOWNLOAD_TIMEOUT_SEC):
+    """下載遠端圖片再收進來 (只在上架 / 批次補圖時呼叫，不會在畫面上連外)"""
+    request = urllib.request.Request(url, headers={"User-Agent": "shop-image-store"})
+    with urllib.request.urlopen(request, timeout=timeout) as resp:
+        return ingest_bytes(resp.read(MAX_IMAGE_BYTES + 1))
+
+def ingest(source, base_dir=None):
+    """source 可以是 http(s) 網址或本地檔案路徑 (相對路徑以 base_dir 為準)"""
+    if source.startswith(("http://", "https://")):
+        return ingest_url(source)
+    if base_dir and not os.path.isabs(source):
+        source = os.path.join(base_dir, source)
+    return ingest_file(source)
+
+def has_image(key):
+    return is_image_key(key) and os.path.exists(_path(key))
+
+# ==========================================
+# 網址
+# ==========================================
+def image_url(key, width=CARD_WIDTH):
+    """本地圖片的靜態網址：有對應寬度的縮圖就用縮圖，沒有 (未安裝 Pillow) 就用原圖"""
+    name = _thumb_name(key, width)
+    if not os.path.exists(_path(name)):
+        name = key
+    return f"{STATIC_URL}/{name[:2]}/{name}"
+
+def product_image_url(product, width=CARD_WIDTH):
+    """商品卡片用的圖片：已收進本地的用縮圖，還沒收的 (舊資料) 才退回原本的外部網址"""
+    key = product.get("image_key")
+    if is_image_key(key):
+        return image_url(key, width)
+    return product.get("image")
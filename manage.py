@@ -0,0 +1,103 @@
+# manage.py
+# 維運用指令列工具，例如：python manage.py backfill-analytics
+import argparse
+import image_store
+from database import (configure_db, init_db, migrate, check_query_plans, rebuild_analytics, backfill_order_items,
+                      archive_orders, get_archive_stats, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, rebuild_product_pairs,
+                      publish_catalog_snapshot, iter_products, set_product_image_keys)
+from bulk_io import import_products_file, export_products_file, export_orders_file
+
+def main():
+    parser = argparse.ArgumentParser(description="商店維運指令")
+    parser.add_argument("--db", help="資料庫檔案路徑 (預設 shop.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("migrate", help="套用尚未執行的 schema 遷移")
+    sub.add_parser("check-plans", help="用 EXPLAIN QUERY PLAN 確認熱門查詢都有走索引")
+    sub.add_parser("backfill-analytics", help="依現有訂單重建營運統計表 (每日營收 / 訂單狀態)")
+    sub.add_parser("backfill-order-items", help="解析舊訂單的商品摘要文字，補建 order_items 明細")
+    sub.add_parser("rebuild-recommendations", help="依全部訂單明細重建「一起購買」的商品共現索引")
+    sub.add_parser("publish-catalog", help="從資料庫重新發佈商品目錄快照 (直接改過資料庫之後用)")
+    sub.add_parser("ingest-images", help="把還沒收進本地圖庫的商品圖片下載下來並產生縮圖")
+
+    p_archive = sub.add_parser("archive-orders", help="把結案 (已完成 / 取消) 很久的訂單搬到封存表")
+    p_archive.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help=f"結案超過幾天才封存 (預設 {ARCHIVE_AFTER_DAYS})")
+    p_archive.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="每個交易搬移的筆數")
+
+    p_import = sub.add_parser("import-products", help="從 CSV / JSON Lines 批次匯入商品 (有 id 的會覆蓋)")
+    p_import.add_argument("path")
+    p_import.add_argument("--format", choices=["csv", "jsonl"], help="預設依副檔名判斷")
+    p_import.add_argument("--dry-run", action="store_true", help="只驗證，不寫入")
+    p_import.add_argument("--skip-invalid", action="store_true", help="略過錯誤的列，其餘照常匯入")
+
+    p_export = sub.add_parser("export-products", help="把商品匯出成 CSV / JSON Lines")
+    p_export.add_argument("path")
+    p_export.add_argument("--format", choices=["csv", "jsonl"], help="預設依副檔名判斷")
+
+    p_orders = sub.add_parser("export-orders", help="把訂單串流匯出成 CSV / JSON Lines / Parquet (財務報表)")
+    p_orders.add_argument("path")
+    p_orders.add_argument("--format", choices=["csv", "jsonl", "parquet"], help="預設依副檔名判斷")
+    p_orders.add_argument("--status", help="只匯出此狀態的訂單")
+    p_orders.add_argument("--from", dest="date_from", help="起始日期 YYYY-MM-DD (含)")
+    p_orders.add_argument("--to", dest="date_to", help="結束日期 YYYY-MM-DD (含)")
+    p_orders.add_argument("--include-archived", action="store_true", help="連同封存的訂單一起匯出")
+
+    args = parser.parse_args()
+    if args.db:
+        configure_db(args.db)
+    if args.command == "migrate":
+        start, version = migrate()
+        print(f"schema 版本：{start} → {version}")
+        return
+    init_db()
+
+    if args.command == "check-plans":
+        for name, plan in check_query_plans().items():
+            print(f"{name}: {' / '.join(plan)}")
+    elif args.command == "backfill-analytics":
+        days, statuses = rebuild_analytics()
+        print(f"統計表重建完成：{days} 天營收、{statuses} 種訂單狀態")
+    elif args.command == "backfill-order-items":
+        print(f"訂單明細補建完成：處理 {backfill_order_items()} 筆")
+    elif args.command == "rebuild-recommendations":
+        print(f"共現索引重建完成：{rebuild_product_pairs()} 組商品對")
+    elif args.command == "ingest-images":
+        # 同一個網址只下載一次；失敗的商品保留原網址，下次再補
+        pairs, seen, failed = [], {}, 0
+        for product_id, name, _, _, image, image_key in iter_products():
+            if image_store.has_image(image_key) or not image:
+                continue
+            if image not in seen:
+                try:
+                    seen[image] = image_store.ingest(image)
+                except (OSError, ValueError) as e:
+                    seen[image] = None
+                    print(f"#{product_id} {name}：{e}")
+            if seen[image] is None:
+                failed += 1
+            else:
+                pairs.append((product_id, seen[image]))
+        if pairs:
+            set_product_image_keys(pairs)
+        print(f"已收錄 {len(pairs)} 個商品的圖片 (共 {sum(1 for k in seen.values() if k)} 張不同的圖)，失敗 {failed} 個")
+    elif args.command == "publish-catalog":
+        print(f"商品目錄快照已發佈：第 {publish_catalog_snapshot()} 代")
+    elif args.command == "archive-orders":
+        moved = archive_orders(args.days, args.batch_size)
+        hot, cold = get_archive_stats()
+        print(f"已封存 {moved} 筆訂單 (目前進行中 / 近期 {hot} 筆，封存 {cold} 筆)")
+    elif args.command == "import-products":
+        report = import_products_file(args.path, args.format, dry_run=args.dry_run, skip_invalid=args.skip_invalid)
+        for line_no, error in report["errors"]:
+            print(f"第 {line_no} 列：{error}")
+        status = "已寫入" if report["committed"] else "未寫入"
+        print(f"共 {report['rows']} 列，有效 {report['valid']} 列，錯誤 {report['rows'] - report['valid']} 列 ({status})")
+    elif args.command == "export-products":
+        print(f"已匯出 {export_products_file(args.path, args.format)} 筆商品")
+    elif args.command == "export-orders":
+        count = export_orders_file(args.path, args.format, status=args.status, date_from=args.date_from,
+                                   date_to=args.date_to, include_archived=args.include_archived)
+        print(f"已匯出 {count} 筆訂單")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# order_writer.py
+# 背景寫入執行緒：結帳尖峰時把多個 session 送出的訂單 / 狀態更新合併成一次 commit (group commit)
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import database
+
+# 一批最多幾筆、第一筆進來後最多再等多久收集同一批
+MAX_BATCH_SIZE = 64
+MAX_WAIT_MS = 5
+
+_queue = queue.Queue()
+_thread = None
+_start_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"batches": 0, "writes": 0, "failed": 0, "last_batch": 0, "max_batch": 0}
+
+# ==========================================
+# 對外介面：排入佇列，回傳 Future
+# ==========================================
+def submit_order(username, name, email, address, total, original, discount, items, line_items=(), promotion_id=None):
+    """排入一筆訂單；Future.result() 會在該批 commit 之後回傳訂單編號"""
+    return _submit(database.write_order, (username, name, email, address, total, original, discount, items,
+                                          line_items, promotion_id))
+
+def submit_status_update(order_id, new_status):
+    """排入一筆訂單狀態更新；Future.result() 會在 commit 之後返回"""
+    return _submit(database.write_status_update, (order_id, new_status))
+
+def submit_status_updates(order_ids, new_status):
+    """排入一次批次狀態更新；Future.result() 會在 commit 之後回傳實際變更的筆數"""
+    return _submit(database.write_status_updates, (list(order_ids), new_status))
+
+def get_writer_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["queue_depth"] = _queue.qsize()
+    stats["avg_batch"] = stats["writes"] / stats["batches"] if stats["batches"] else 0
+    return stats
+
+def stop_writer(timeout=None):
+    """寫完佇列中剩下的工作後結束背景執行緒 (壓測 / 關機用)"""
+    global _thread
+    with _start_lock:
+        if _thread is None:
+            return
+        _queue.put(None)
+        _thread.join(timeout)
+        _thread = None
+
+def _submit(func, args):
+    future = Future()
+    _ensure_started()
+    _queue.put((func, args, future))
+    return future
+
+def _ensure_started():
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    with _start_lock:
+        # 執行緒意外結束的話重新啟動，佇列中還沒處理的工作由新的執行緒接手
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name="order-writer", daemon=True)
+            _thread.start()
+
+# ==========================================
+# 背景執行緒
+# ==========================================
+def _run():
+    # 寫入連線由這個執行緒獨佔；synchronous=FULL 讓每批 commit 都 fsync，
+    # 一批只付一次 fsync，回傳給 UI 的訂單就是真的落地了
+    conn = database._new_connection()
+    conn.execute("PRAGMA synchronous=FULL")
+    try:
+        while True:
+            job = _queue.get()
+            if job is None:
+                return
+            batch = [job]
+            deadline = time.monotonic() + MAX_WAIT_MS / 1000
+            while len(batch) < MAX_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                try:
+                    job = _queue.get(timeout=remaining) if remaining > 0 else _queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    _safe_write_batch(conn, batch)
+                    return
+                batch.append(job)
+            _safe_write_batch(conn, batch)
+    finally:
+        conn.close()
+
+def _safe_write_batch(conn, batch):
+    # 任何意外都不能讓執行緒結束或留下沒有結果的 Future (呼叫端會一直等)
+    try:
+        _write_batch(conn, batch)
+    except Exception as e:
+        if conn.in_transaction:
+            conn.rollback()
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+def _write_batch(conn, batch):
+    results = []
+    try:
+        database._begin_immediate(conn)
+        for func, args, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            # 每筆用 SAVEPOINT 隔開，單筆失敗不會拖累同一批的其他訂單
+            conn.execute("SAVEPOINT batch_item")
+            try:
+                results.append((future, func(conn, *args), None))
+                conn.execute("RELEASE batch_item")
+            except Exception as e:
+                conn.execute("ROLLBACK TO batch_item")
+                conn.execute("RELEASE batch_item")
+                results.append((future, None, e))
+        conn.commit()
+    except Exception as e:
+        # commit 本身失敗：整批都沒有寫入
+        if conn.in_transaction:
+            conn.rollback()
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        with _stats_lock:
+            _stats["failed"] += len(batch)
+        return
+
+    with _stats_lock:
+        _stats["batches"] += 1
+        _stats["writes"] += len(results)
+        _stats["failed"] += sum(1 for _, _, e in results if e is not None)
+        _stats["last_batch"] = len(results)
+        _stats["max_batch"] = max(_stats["max_batch"], len(results))
+    for future, value, error in results:
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+    # 這批有商品售完的話，commit 之後才讓商品快取失效 (先回覆結帳結果，不讓它們等快取)
+    try:
+        database.flush_catalog_changes(conn)
+    except Exception as e:
+        print(e)
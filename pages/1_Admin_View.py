@@ -1,15 +1,26 @@
 # pages/1_Admin_View.py
 import streamlit as st
 import pandas as pd
+import io
 import sys
 import os
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 # 將上一層目錄加入系統路徑
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from database import get_all_orders, update_order_status, add_new_product
+from database import (init_db, get_orders_page, add_new_product, get_catalog_cache_stats,
+                      get_sales_summary, get_daily_revenue, get_status_counts,
+                      get_promotions, add_promotion, set_promotion_active,
+                      archive_orders, get_archive_stats, ARCHIVE_AFTER_DAYS, iter_orders, count_orders,
+                      set_product_stock, get_lock_stats)
+from order_writer import submit_status_update, submit_status_updates, get_writer_stats
+from bulk_io import detect_format, import_products, export_products_bytes, export_orders_bytes, pq
+import image_store
+import perf
 
 st.set_page_config(page_title="管理員後台", page_icon="🔧", layout="wide")
+init_db()  # 同一個 process 只會真正執行一次遷移
 
 # CSS 美化 (維持 Dark Mode 修復版)
 st.markdown("""
@@ -42,6 +53,63 @@ def login_section():
                 else:
                     st.error("❌ 帳號密碼錯誤")
 
+# ==========================================
+# 訂單管理：狀態更新與分頁 callback
+# ==========================================
+STATUS_OPTIONS = ["處理中", "已出貨", "已完成", "取消"]
+ORDERS_PAGE_SIZE = 20
+# 等背景寫入執行緒回覆的秒數；逾時代表佇列很忙，更新仍會寫入
+WRITE_ACK_TIMEOUT = 10
+
+def apply_status_update(order_id):
+    try:
+        submit_status_update(order_id, st.session_state[f"s_{order_id}"]).result(timeout=WRITE_ACK_TIMEOUT)
+    except FutureTimeoutError:
+        st.toast("⏳ 寫入佇列忙碌中，狀態更新已排入，稍後重新整理確認")
+        return
+    st.toast("✅ 狀態已更新！")
+
+def _apply_bulk_status(order_ids):
+    try:
+        changed = submit_status_updates(order_ids, st.session_state.bulk_status).result(timeout=WRITE_ACK_TIMEOUT)
+    except FutureTimeoutError:
+        st.toast("⏳ 寫入佇列忙碌中，批次更新已排入，稍後重新整理確認")
+        return
+    # 清掉勾選與各列的狀態下拉選單，下次 rerun 依資料庫的新狀態重建
+    for order_id in order_ids:
+        st.session_state.pop(f"sel_{order_id}", None)
+        st.session_state.pop(f"s_{order_id}", None)
+    st.toast(f"✅ 已更新 {changed} 筆訂單為「{st.session_state.bulk_status}」")
+
+def apply_bulk_to_selected():
+    order_ids = [int(k[4:]) for k, v in st.session_state.items() if k.startswith("sel_") and v]
+    if not order_ids:
+        st.toast("⚠️ 請先勾選訂單")
+        return
+    _apply_bulk_status(order_ids)
+
+def _hot_filters(filters):
+    # 封存的訂單不能修改，只套用到訂單表中符合條件的訂單
+    return {k: v for k, v in filters.items() if k != "include_archived"}
+
+def request_bulk_to_filter(filters):
+    # 套用到整個篩選結果前先確認一次 (顯示會變更的筆數)
+    st.session_state.bulk_filter_pending = filters
+
+def cancel_bulk_to_filter():
+    st.session_state.pop("bulk_filter_pending", None)
+
+def apply_bulk_to_filter(filters):
+    st.session_state.pop("bulk_filter_pending", None)
+    _apply_bulk_status([row[0] for row in iter_orders(**_hot_filters(filters))])
+
+def next_orders_page(last_id):
+    st.session_state.order_cursors.append(last_id)
+
+def prev_orders_page():
+    if len(st.session_state.order_cursors) > 1:
+        st.session_state.order_cursors.pop()
+
 # ==========================================
 # 後台主功能
 # ==========================================
@@ -54,25 +122,20 @@ def admin_dashboard():
             st.rerun()
             
     st.title("🔧 營運管理儀表板")
-    
-    # 讀取訂單資料
-    df_orders = get_all_orders()
 
     # 使用 Tabs 分頁管理不同功能
-    tab1, tab2, tab3 = st.tabs(["📊 數據分析 (Dashboard)", "📋 訂單管理 (Orders)", "➕ 商品上架 (Product)"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📊 數據分析 (Dashboard)", "📋 訂單管理 (Orders)", "➕ 商品上架 (Product)",
+                                            "🏷️ 促銷活動 (Promotions)", "⏱️ 效能 (Performance)"])
     
     # --- Tab 1: 數據分析 (BI Dashboard) ---
-    with tab1:
+    # 只讀預先彙總的統計表，訂單再多載入時間也不會變
+    with tab1, perf.section("render.admin_dashboard"):
         st.subheader("營運數據總覽")
-        if df_orders.empty:
+        total_rev, total_orders = get_sales_summary()
+        if total_orders == 0:
             st.info("目前沒有數據可分析")
         else:
-            # 資料前處理
-            df_orders['order_date'] = pd.to_datetime(df_orders['order_date'])
-
             # 1. 關鍵指標 (KPIs)
-            total_rev = df_orders['total_amount'].sum()
-            total_orders = len(df_orders)
             avg_order = total_rev / total_orders if total_orders > 0 else 0
             
             k1, k2, k3 = st.columns(3)
@@ -86,16 +149,62 @@ def admin_dashboard():
             c1, c2 = st.columns(2)
             with c1:
                 st.markdown("##### 📅 每日營收趨勢")
-                daily_revenue = df_orders.groupby(df_orders['order_date'].dt.date)['total_amount'].sum()
+                df_daily = get_daily_revenue()
+                daily_revenue = df_daily.set_index(pd.to_datetime(df_daily['day']))['revenue']
                 st.line_chart(daily_revenue)
             with c2:
                 st.markdown("##### 📦 訂單狀態分佈")
-                status_counts = df_orders['status'].value_counts()
+                status_counts = get_status_counts().set_index('status')['order_count']
                 st.bar_chart(status_counts)
 
     # --- Tab 2: 訂單管理 ---
-    with tab2:
+    # 篩選與分頁都在 SQL 端完成，一次只產生一頁的元件
+    with tab2, perf.section("render.admin_orders"):
         st.subheader("詳細訂單列表")
+
+        f1, f2, f3, f4 = st.columns(4)
+        with f1: status_filter = st.selectbox("狀態", ["全部"] + STATUS_OPTIONS, key="flt_status")
+        with f2: date_range = st.date_input("下單日期", value=(), key="flt_dates")
+        with f3: username_filter = st.text_input("購買帳號", key="flt_user")
+        with f4: customer_filter = st.text_input("收件人姓名", key="flt_customer")
+        # 預設只查熱表；勾選後才連同封存表一起分頁
+        include_archived = st.checkbox("包含已封存訂單", key="flt_archived")
+
+        filters = {
+            "status": None if status_filter == "全部" else status_filter,
+            "date_from": date_range[0] if len(date_range) > 0 else None,
+            "date_to": date_range[1] if len(date_range) > 1 else None,
+            "username": username_filter.strip() or None,
+            "customer_name": customer_filter.strip() or None,
+            "include_archived": include_archived,
+        }
+        # 篩選條件改變就回到第一頁；order_cursors 記錄每一頁的起點 (before_id)
+        if st.session_state.get("order_filters") != filters:
+            st.session_state.order_filters = filters
+            st.session_state.order_cursors = [None]
+
+        df_orders, has_more = get_orders_page(st.session_state.order_cursors[-1], ORDERS_PAGE_SIZE, **filters)
+
+        # 批次更新：勾選的訂單或所有符合篩選條件的訂單，一次交易寫完，只重跑一次
+        b1, b2, b3 = st.columns([1, 1, 1])
+        with b1: st.selectbox("批次更新為", STATUS_OPTIONS, index=1, key="bulk_status")
+        with b2: st.button("套用到勾選的訂單", on_click=apply_bulk_to_selected, use_container_width=True)
+        # 沒有任何篩選條件時不允許「全部套用」，避免一鍵改掉所有訂單 (包含已完成 / 取消的)
+        has_filter = any(_hot_filters(filters).values())
+        with b3: st.button("套用到所有符合篩選的訂單", on_click=request_bulk_to_filter, args=(filters,),
+                           disabled=not has_filter, help=None if has_filter else "請先設定至少一個篩選條件",
+                           use_container_width=True)
+        pending = st.session_state.get("bulk_filter_pending")
+        if pending is not None and pending != filters:
+            # 篩選條件已經改了，之前的確認作廢
+            cancel_bulk_to_filter()
+        elif pending is not None:
+            matched = count_orders(**_hot_filters(filters))
+            st.warning(f"⚠️ 確定要把符合篩選的 {matched} 筆訂單 (不含封存) 全部改為「{st.session_state.bulk_status}」嗎？")
+            c1, c2 = st.columns(2)
+            with c1: st.button(f"確認更新 {matched} 筆", on_click=apply_bulk_to_filter, args=(filters,),
+                               type="primary", use_container_width=True)
+            with c2: st.button("取消", on_click=cancel_bulk_to_filter, use_container_width=True)
         
         if df_orders.empty:
             st.info("目前沒有任何訂單")
@@ -103,7 +212,11 @@ def admin_dashboard():
             for index, row in df_orders.iterrows():
                 status_icon = "🟢" if row['status'] == "已完成" else "🚚" if row['status'] == "已出貨" else "⏳"
                 
-                with st.expander(f"{status_icon} 訂單 #{row['id']} - {row['customer_name']} (實付: ${row['total_amount']:,})"):
+                c_sel, c_row = st.columns([1, 24])
+                with c_sel:
+                    if not row.get('archived'):
+                        st.checkbox("選取", key=f"sel_{row['id']}", label_visibility="collapsed")
+                with c_row, st.expander(f"{status_icon} 訂單 #{row['id']} - {row['customer_name']} (實付: ${row['total_amount']:,})"):
                     col1, col2 = st.columns([2, 1])
                     with col1:
                         st.markdown(f"**購買帳號：** {row['username']}")
@@ -116,38 +229,216 @@ def admin_dashboard():
                     
                     with col2:
                         current_status = row['status']
-                        opts = ["處理中", "已出貨", "已完成", "取消"]
-                        idx = opts.index(current_status) if current_status in opts else 0
-                        
-                        new_status = st.selectbox("更新狀態", opts, index=idx, key=f"s_{row['id']}")
-                        if st.button("更新狀態", key=f"upd_{row['id']}"):
-                            update_order_status(row['id'], new_status)
-                            st.toast("✅ 狀態已更新！")
-                            st.rerun()
+                        if row.get('archived'):
+                            st.caption(f"🗄️ 已封存 ({current_status})，無法修改")
+                        else:
+                            idx = STATUS_OPTIONS.index(current_status) if current_status in STATUS_OPTIONS else 0
+                            
+                            st.selectbox("更新狀態", STATUS_OPTIONS, index=idx, key=f"s_{row['id']}")
+                            # 用 on_click 在 rerun 前寫入，不需要再呼叫 st.rerun()
+                            st.button("更新狀態", key=f"upd_{row['id']}", on_click=apply_status_update, args=(int(row['id']),))
+
+        # 分頁控制
+        p1, p2, p3 = st.columns([1, 2, 1])
+        with p1:
+            st.button("⬅️ 上一頁", disabled=len(st.session_state.order_cursors) == 1, on_click=prev_orders_page)
+        with p2:
+            writer = get_writer_stats()
+            st.caption(f"第 {len(st.session_state.order_cursors)} 頁｜寫入佇列 {writer['queue_depth']} 筆，"
+                       f"平均每批 {writer['avg_batch']:.1f} 筆 (最大 {writer['max_batch']})")
+        with p3:
+            st.button("下一頁 ➡️", disabled=not has_more, on_click=next_orders_page,
+                      args=(int(df_orders['id'].iloc[-1]) if has_more else None,))
+
+        # 匯出：依目前的篩選條件串流產生檔案 (也可用 python manage.py export-orders)
+        e1, e2 = st.columns([3, 1])
+        with e1:
+            order_fmts = ["csv", "jsonl"] + (["parquet"] if pq is not None else [])
+            order_fmt = st.radio("訂單匯出格式 (依目前篩選條件)", order_fmts, horizontal=True, key="order_export_fmt")
+        with e2:
+            if st.button("產生訂單匯出檔"):
+                st.download_button("⬇️ 下載訂單", export_orders_bytes(order_fmt, **filters),
+                                   file_name=f"orders.{order_fmt}",
+                                   mime={"csv": "text/csv", "jsonl": "application/x-ndjson"}.get(order_fmt, "application/octet-stream"))
+
+        # 封存：結案超過 ARCHIVE_AFTER_DAYS 天的訂單搬到封存表 (也可用 python manage.py archive-orders)
+        hot_count, archived_count = get_archive_stats()
+        a1, a2 = st.columns([3, 1])
+        with a1: st.caption(f"訂單表 {hot_count} 筆｜封存表 {archived_count} 筆")
+        with a2:
+            if st.button(f"封存 {ARCHIVE_AFTER_DAYS} 天前已結案的訂單"):
+                st.toast(f"🗄️ 已封存 {archive_orders()} 筆訂單")
 
     # --- Tab 3: 商品上架 ---
-    with tab3:
+    with tab3, perf.section("render.admin_products"):
         st.subheader("新增上架商品")
         with st.container(border=True):
             with st.form("add_product_form"):
                 name = st.text_input("商品名稱")
                 category = st.selectbox("分類", ["3C周邊", "影音設備", "辦公家具", "玩具", "其他"])
                 
-                c1, c2 = st.columns(2)
+                c1, c2, c3 = st.columns(3)
                 with c1: price = st.number_input("價格", min_value=1, step=100)
                 with c2: image = st.text_input("圖片網址", placeholder="https://...")
+                with c3: stock = st.number_input("庫存 (0 = 不追蹤)", min_value=0, step=10)
+                image_file = st.file_uploader("或上傳圖片檔", type=["jpg", "jpeg", "png", "gif", "webp"])
 
                 submitted = st.form_submit_button("確認上架")
                 
                 if submitted:
-                    if name and price and image:
-                        if add_new_product(name, category, int(price), image):
-                            st.success(f"✅ 已成功上架：{name}")
+                    if name and price and (image or image_file is not None):
+                        # 圖片收進本地圖庫 (內容定址 + 預先產生縮圖)，商品卡片之後讀本地縮圖
+                        image_key, ok = None, True
+                        if image_file is not None:
+                            try:
+                                image_key = image_store.ingest_bytes(image_file.getvalue())
+                            except ValueError as e:
+                                st.error(f"圖片無法使用：{e}")
+                                ok = False
                         else:
-                            st.error("上架失敗")
+                            try:
+                                image_key = image_store.ingest_url(image)
+                            except (OSError, ValueError) as e:
+                                st.warning(f"圖片下載失敗，商品卡片會直接使用原網址：{e}")
+                        if ok:
+                            if add_new_product(name, category, int(price), image, int(stock) or None, image_key):
+                                st.success(f"✅ 已成功上架：{name}")
+                            else:
+                                st.error("上架失敗")
                     else:
                         st.warning("⚠️ 請填寫完整資訊")
 
+        # 補貨 / 盤點
+        st.subheader("庫存調整")
+        with st.container(border=True):
+            with st.form("stock_form"):
+                c1, c2, c3 = st.columns(3)
+                with c1: stock_product_id = st.number_input("商品編號", min_value=1, step=1)
+                with c2: new_stock = st.number_input("庫存數量", min_value=0, step=1)
+                with c3: untracked = st.checkbox("不追蹤庫存")
+                if st.form_submit_button("更新庫存"):
+                    set_product_stock(int(stock_product_id), None if untracked else int(new_stock))
+                    st.success(f"✅ 商品 #{int(stock_product_id)} 庫存已更新")
+
+        # 批次匯入 / 匯出 (ERP 同步)
+        st.subheader("批次匯入 / 匯出")
+        with st.container(border=True):
+            st.caption("欄位：id (選填，填了會覆蓋同 id 商品), name, category, price, image, "
+                       "image_key / image_file (選填，本機圖檔路徑，會收進本地圖庫)")
+            uploaded = st.file_uploader("上傳商品檔 (CSV / JSON Lines)", type=["csv", "jsonl", "ndjson"])
+            c1, c2 = st.columns(2)
+            with c1: dry_run = st.checkbox("只驗證不寫入 (Dry run)", value=True)
+            with c2: skip_invalid = st.checkbox("略過錯誤的列")
+            if uploaded is not None and st.button("開始匯入"):
+                stream = io.TextIOWrapper(uploaded, encoding="utf-8-sig", newline="")
+                report = import_products(stream, detect_format(uploaded.name), dry_run=dry_run, skip_invalid=skip_invalid)
+                error_rows = report['rows'] - report['valid']
+                msg = f"共 {report['rows']} 列，有效 {report['valid']} 列，錯誤 {error_rows} 列"
+                if report["committed"]:
+                    st.success(f"✅ 匯入完成：{msg}")
+                elif dry_run:
+                    st.info(f"🔍 驗證結果 (未寫入)：{msg}")
+                else:
+                    st.error(f"❌ 有錯誤，整批未寫入：{msg}")
+                if report["errors"]:
+                    st.dataframe(pd.DataFrame(report["errors"], columns=["列號", "錯誤"]), hide_index=True)
+
+            export_fmt = st.radio("匯出格式", ["csv", "jsonl"], horizontal=True)
+            if st.button("產生匯出檔"):
+                st.download_button("⬇️ 下載商品檔", export_products_bytes(export_fmt),
+                                   file_name=f"products.{export_fmt}", mime="text/csv" if export_fmt == "csv" else "application/x-ndjson")
+
+        stats = get_catalog_cache_stats()
+        st.caption(f"商品快取：版本 {stats['version']}｜命中 {stats['hits']} 次｜未命中 {stats['misses']} 次")
+
+    # --- Tab 4: 促銷活動 ---
+    with tab4, perf.section("render.admin_promotions"):
+        st.subheader("新增促銷活動")
+        with st.container(border=True):
+            with st.form("add_promotion_form"):
+                c1, c2 = st.columns(2)
+                with c1: promo_name = st.text_input("活動名稱")
+                with c2: promo_code = st.text_input("優惠碼 (留空 = 自動套用)")
+
+                c1, c2, c3 = st.columns(3)
+                with c1: kind_label = st.selectbox("折扣方式", ["百分比折扣 (%)", "固定金額折抵"])
+                with c2: value = st.number_input("折扣值 (10 = 打九折 / 折抵金額)", min_value=1, step=1)
+                with c3: min_spend = st.number_input("最低消費", min_value=0, step=100)
+
+                c1, c2 = st.columns(2)
+                with c1: scope_label = st.selectbox("適用範圍", ["全館", "指定分類", "指定商品編號"])
+                with c2: target = st.text_input("分類名稱 / 商品編號 (全館免填)")
+
+                c1, c2 = st.columns(2)
+                with c1: period = st.date_input("活動期間 (可不填)", value=())
+                with c2: usage_limit = st.number_input("使用次數上限 (0 = 不限)", min_value=0, step=1)
+
+                if st.form_submit_button("建立活動"):
+                    scope = {"全館": "all", "指定分類": "category", "指定商品編號": "product"}[scope_label]
+                    kind = "percent" if kind_label.startswith("百分比") else "fixed"
+                    if not promo_name:
+                        st.warning("⚠️ 請填寫活動名稱")
+                    elif scope != "all" and not target.strip():
+                        st.warning("⚠️ 請填寫適用的分類或商品編號")
+                    elif scope == "product" and not target.strip().isdigit():
+                        st.warning("⚠️ 商品編號必須是數字")
+                    elif kind == "percent" and value > 100:
+                        st.warning("⚠️ 百分比折扣不能超過 100%")
+                    else:
+                        add_promotion(promo_name, kind, int(value),
+                                      scope, target.strip() or None, promo_code or None, int(min_spend),
+                                      f"{period[0]} 00:00:00" if len(period) > 0 else None,
+                                      f"{period[1]} 23:59:59" if len(period) > 1 else None,
+                                      int(usage_limit) or None)
+                        st.success(f"✅ 已建立活動：{promo_name}")
+
+        st.subheader("活動列表")
+        df_promos = get_promotions()
+        if df_promos.empty:
+            st.info("目前沒有促銷活動")
+        else:
+            st.dataframe(df_promos, hide_index=True, use_container_width=True)
+            c1, c2 = st.columns([2, 1])
+            with c1: promo_id = st.selectbox("選擇活動", df_promos['id'].tolist(),
+                                             format_func=lambda i: f"#{i} {df_promos.set_index('id').loc[i, 'name']}")
+            with c2:
+                is_active = bool(df_promos.set_index('id').loc[promo_id, 'active'])
+                if st.button("停用活動" if is_active else "重新啟用"):
+                    set_promotion_active(int(promo_id), not is_active)
+                    st.rerun()
+
+    # --- Tab 5: 效能 ---
+    # 資料取自 perf 的 process 內統計 (所有 session 共用)，重新啟動後歸零
+    with tab5:
+        st.subheader("資料庫與畫面耗時")
+        stats = perf.get_stats()
+        if not stats:
+            st.info("目前還沒有量測資料")
+        else:
+            df_perf = pd.DataFrame(stats).drop(columns=["buckets"])
+            st.dataframe(df_perf, hide_index=True, use_container_width=True,
+                         column_config={"name": "項目", "count": "次數", "total_ms": "總耗時 (ms)", "avg_ms": "平均 (ms)",
+                                        "p50_ms": "p50 ≤ (ms)", "p95_ms": "p95 ≤ (ms)", "max_ms": "最大 (ms)",
+                                        "avg_rows": "平均筆數", "statements": "SQL 數"})
+            picked = st.selectbox("耗時分佈", [r["name"] for r in stats])
+            buckets = next(r["buckets"] for r in stats if r["name"] == picked)
+            labels = [f"≤{b}ms" for b in perf.BUCKETS_MS] + [f">{perf.BUCKETS_MS[-1]}ms"]
+            st.bar_chart(pd.DataFrame({"次數": buckets}, index=pd.CategoricalIndex(labels, categories=labels, ordered=True)))
+
+        locks = get_lock_stats()
+        st.caption(f"寫入鎖：{locks['transactions']} 次交易｜平均等待 {locks['wait_ms_avg']:.2f} ms (最長 {locks['wait_ms_max']:.1f} ms)｜"
+                   f"重試 {locks['busy_retries']} 次｜失敗 {locks['busy_failures']} 次")
+
+        st.subheader(f"慢查詢紀錄 (≥ {perf.SLOW_QUERY_MS:g} ms)")
+        slow = perf.get_slow_log()
+        if slow:
+            st.dataframe(pd.DataFrame(slow), hide_index=True, use_container_width=True)
+        else:
+            st.caption("目前沒有慢查詢")
+        if st.button("清除統計"):
+            perf.reset()
+            st.rerun()
+
 # ==========================================
 # 頁面邏輯入口
 # ==========================================
@@ -6,9 +6,27 @@ import os
 # [重要] 將上一層目錄加入系統路徑
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from database import get_user_orders
+from database import (init_db, get_user_profile, update_user_profile, get_user_order_count,
+                      get_user_order_summaries, get_order_detail)
 
 st.set_page_config(page_title="會員中心", page_icon="👤")
+init_db()  # 同一個 process 只會真正執行一次遷移
+
+# 狀態顏色
+STATUS_ICONS = {
+    "已完成": "🟢",
+    "已出貨": "🚚",
+    "處理中": "⏳",
+    "取消": "🔴"
+}
+HISTORY_PAGE_SIZE = 10
+
+def next_history_page(last_id):
+    st.session_state.history_cursors.append(last_id)
+
+def prev_history_page():
+    if len(st.session_state.history_cursors) > 1:
+        st.session_state.history_cursors.pop()
 
 st.title("📦 我的訂單記錄")
 st.markdown("---")
@@ -20,32 +38,62 @@ if not current_user:
     st.markdown("前往 **Home** 頁面進行登入。")
 else:
     st.success(f"👋 歡迎回來，**{current_user}**")
+
+    # 會員資料 (存在 session，修改後同步更新快取與 session)
+    if st.session_state.get('profile') is None:
+        st.session_state.profile = get_user_profile(current_user)
+    profile = st.session_state.profile or {}
+    with st.expander("👤 會員資料"):
+        with st.form("profile_form"):
+            p_name = st.text_input("真實姓名", value=profile.get('real_name') or "")
+            p_email = st.text_input("Email", value=profile.get('email') or "")
+            p_addr = st.text_input("地址", value=profile.get('address') or "")
+            if st.form_submit_button("儲存"):
+                update_user_profile(current_user, p_email, p_name, p_addr)
+                st.session_state.profile = get_user_profile(current_user)
+                st.success("會員資料已更新")
     
-    # 讀取該使用者的訂單
-    df = get_user_orders(current_user)
+    # 訂單記錄：一次只讀一頁摘要，展開某筆訂單時才讀明細 (結案很久的訂單已封存，勾選才一起查)
+    include_archived = st.checkbox("顯示已封存的歷史訂單")
+    # 換帳號或切換封存選項就回到第一頁；history_cursors 記錄每一頁的起點 (before_id)
+    history_key = (current_user, include_archived)
+    if st.session_state.get("history_key") != history_key:
+        st.session_state.history_key = history_key
+        st.session_state.history_cursors = [None]
+
+    total_count, archived_count = get_user_order_count(current_user)
+    df, has_more = get_user_order_summaries(current_user, st.session_state.history_cursors[-1],
+                                            HISTORY_PAGE_SIZE, include_archived)
     
     if not df.empty:
-        st.markdown(f"您共有 **{len(df)}** 筆訂單：")
-        for i, row in df.iterrows():
-            # 狀態顏色
-            status_map = {
-                "已完成": "🟢",
-                "已出貨": "🚚",
-                "處理中": "⏳",
-                "取消": "🔴"
-            }
-            icon = status_map.get(row['status'], "📦")
+        shown = total_count if include_archived else total_count - archived_count
+        st.markdown(f"您共有 **{shown}** 筆訂單" + (f" (另有 {archived_count} 筆已封存)：" if archived_count and not include_archived else "："))
+        for row in df.itertuples():
+            icon = STATUS_ICONS.get(row.status, "📦")
             
-            with st.expander(f"{icon} {row['order_date']} - 總金額: ${row['total_amount']:,}"):
-                st.write(f"**商品內容：** {row['items_summary']}")
-                
-                c1, c2 = st.columns(2)
-                with c1:
-                    st.write(f"**訂單狀態：** {row['status']}")
-                    if 'discount' in row and row['discount'] > 0:
-                        st.caption(f"(含折扣: -${row['discount']:,})")
-                with c2:
-                    st.write(f"**收件資訊：** {row['customer_name']}")
-                    st.caption(row['customer_address'])
+            order_box = st.expander(f"{icon} {row.order_date} - 總金額: ${row.total_amount:,}", key=f"order_{row.id}", on_change="rerun")
+            if order_box.open:
+                detail = get_order_detail(row.id, current_user)
+                with order_box:
+                    st.write(f"**商品內容：** {detail['items_summary']}")
+                    
+                    c1, c2 = st.columns(2)
+                    with c1:
+                        st.write(f"**訂單狀態：** {detail['status']}")
+                        if detail['discount']:
+                            st.caption(f"(含折扣: -${detail['discount']:,})")
+                    with c2:
+                        st.write(f"**收件資訊：** {detail['customer_name']}")
+                        st.caption(detail['customer_address'])
+
+        # 分頁控制
+        p1, p2, p3 = st.columns([1, 2, 1])
+        with p1:
+            st.button("⬅️ 上一頁", disabled=len(st.session_state.history_cursors) == 1, on_click=prev_history_page)
+        with p2:
+            st.caption(f"第 {len(st.session_state.history_cursors)} 頁")
+        with p3:
+            st.button("下一頁 ➡️", disabled=not has_more, on_click=next_history_page,
+                      args=(int(df['id'].iloc[-1]) if has_more else None,))
     else:
-        st.info("🛒 您目前還沒有購買紀錄，快去首頁逛逛吧！")
\ No newline at end of file
+        st.info("🛒 您目前還沒有購買紀錄，快去首頁逛逛吧！")
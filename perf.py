@@ -0,0 +1,157 @@
+# perf.py
+# 輕量的效能量測：資料庫函式與畫面區塊的耗時直方圖 + 慢查詢紀錄 (整個 process 共用，可常駐開啟)
+import functools
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# SHOP_PERF=0 可整個關閉；超過 SLOW_QUERY_MS 的資料庫呼叫會記進慢查詢紀錄
+ENABLED = os.environ.get("SHOP_PERF", "1") != "0"
+SLOW_QUERY_MS = float(os.environ.get("SHOP_SLOW_QUERY_MS", "100"))
+SLOW_LOG_SIZE = 200
+# 每次呼叫最多保留幾條 SQL 文字 (觸發器內的語句也會算進去)
+MAX_STATEMENTS = 5
+
+# 直方圖的桶子上限 (毫秒)，最後一格是超過 2.5 秒
+BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_lock = threading.Lock()
+_metrics = {}        # 名稱 -> {"count", "total_ms", "max_ms", "rows", "statements", "buckets"}
+_slow_log = deque(maxlen=SLOW_LOG_SIZE)
+_local = threading.local()
+
+# ==========================================
+# 記錄
+# ==========================================
+def _row_count(result):
+    # DataFrame / list 直接算長度；(df, has_more) 這種分頁結果算第一個元素
+    if isinstance(result, tuple) and result and hasattr(result[0], "__len__") and not isinstance(result[0], str):
+        result = result[0]
+    if isinstance(result, list) or hasattr(result, "shape"):
+        return len(result)
+    return None
+
+# trace callback 拿到的是代入參數後的 SQL，寫進紀錄前把字串常值遮掉 (密碼、個資)
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+
+def _record(name, elapsed_ms, rows=None, statements=()):
+    i = 0
+    while i < len(BUCKETS_MS) and elapsed_ms > BUCKETS_MS[i]:
+        i += 1
+    with _lock:
+        m = _metrics.get(name)
+        if m is None:
+            m = _metrics[name] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "statements": 0,
+                                  "buckets": [0] * (len(BUCKETS_MS) + 1)}
+        m["count"] += 1
+        m["total_ms"] += elapsed_ms
+        m["max_ms"] = max(m["max_ms"], elapsed_ms)
+        m["rows"] += rows or 0
+        m["statements"] += len(statements)
+        m["buckets"][i] += 1
+        if statements and elapsed_ms >= SLOW_QUERY_MS:
+            _slow_log.append({"time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "name": name,
+                              "ms": round(elapsed_ms, 2), "rows": rows,
+                              "sql": " ; ".join(" ".join(_LITERAL_RE.sub("?", s).split()) for s in statements)})
+
+def trace_sql(statement):
+    """sqlite3 的 trace callback：把 SQL 文字掛到目前執行中的量測區塊上"""
+    stack = getattr(_local, "stack", None)
+    if stack:
+        statements = stack[-1]
+        if len(statements) < MAX_STATEMENTS:
+            statements.append(statement)
+
+def timed(name):
+    """
+    裝飾器：記錄函式耗時、回傳筆數與執行的 SQL。
+    可以寫 @timed("render.display_products")，或直接 @timed (名稱用 db.函式名)。
+    """
+    if callable(name):
+        return timed(f"db.{name.__name__}")(name)
+
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = getattr(_local, "stack", None)
+            if stack is None:
+                stack = _local.stack = []
+            statements = []
+            stack.append(statements)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                elapsed = (time.perf_counter() - start) * 1000
+                stack.pop()
+            _record(name, elapsed, _row_count(result), statements)
+            return result
+        return wrapper
+    return decorator
+
+def section(name):
+    """with section("admin.orders"): ... 量測一段程式碼 (畫面區塊用)"""
+    return _Section(name)
+
+class _Section:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if ENABLED:
+            _record(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+# ==========================================
+# 查詢結果
+# ==========================================
+def _bucket_percentile(buckets, count, pct):
+    # 直方圖只能估到桶子的上限
+    target = count * pct / 100
+    seen = 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if seen >= target:
+            return BUCKETS_MS[i] if i < len(BUCKETS_MS) else float("inf")
+    return float("inf")
+
+def get_stats():
+    """每個量測名稱一列，依總耗時由大到小排序"""
+    with _lock:
+        snapshot = {name: dict(m, buckets=list(m["buckets"])) for name, m in _metrics.items()}
+    rows = []
+    for name, m in snapshot.items():
+        rows.append({
+            "name": name,
+            "count": m["count"],
+            "total_ms": round(m["total_ms"], 1),
+            "avg_ms": round(m["total_ms"] / m["count"], 2),
+            "p50_ms": _bucket_percentile(m["buckets"], m["count"], 50),
+            "p95_ms": _bucket_percentile(m["buckets"], m["count"], 95),
+            "max_ms": round(m["max_ms"], 2),
+            "avg_rows": round(m["rows"] / m["count"], 1),
+            "statements": m["statements"],
+            "buckets": m["buckets"],
+        })
+    rows.sort(key=lambda r: r["total_ms"], reverse=True)
+    return rows
+
+def get_slow_log():
+    """慢查詢紀錄，最新的在前面"""
+    with _lock:
+        return list(reversed(_slow_log))
+
+def reset():
+    with _lock:
+        _metrics.clear()
+        _slow_log.clear()
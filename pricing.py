@@ -0,0 +1,131 @@
+# pricing.py
+# 定價引擎：把啟用中的促銷規則編譯成記憶體內的查表結構，結帳時一次走訪購物車就算出最佳折扣
+import threading
+import time
+from datetime import datetime
+from database import load_active_promotions, get_promotions_version
+
+# 就算沒有人改規則，也定期重新編譯一次 (同步其他 process 的變更與使用次數)
+COMPILE_TTL_SEC = 60
+
+_lock = threading.Lock()
+_compiled = None
+
+# ==========================================
+# 編譯
+# ==========================================
+def _new_index():
+    return {"all": [], "category": {}, "product": {}}
+
+def compile_rules(rows, now=None):
+    """
+    把促銷列 (load_active_promotions 的格式) 編譯成：
+    {"auto": 索引, "codes": {優惠碼: 索引}, "valid_until": 時間字串或 None}
+    索引 = {"all": [規則], "category": {分類: [規則]}, "product": {商品編號: [規則]}}
+    只收錄 now 當下有效的規則；valid_until 是下一個規則開始或結束的時間，過了就要重新編譯。
+    """
+    now = now or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    compiled = {"auto": _new_index(), "codes": {}, "valid_until": None}
+    boundaries = []
+    for row in rows:
+        starts_at, ends_at = row.get("starts_at"), row.get("ends_at")
+        if starts_at and starts_at > now:
+            boundaries.append(starts_at)
+            continue
+        if ends_at and ends_at <= now:
+            continue
+        if ends_at:
+            boundaries.append(ends_at)
+
+        rule = (row["id"], row["name"], row["kind"] == "percent", int(row["value"]), int(row["min_spend"] or 0))
+        code = (row.get("code") or "").strip().upper()
+        index = compiled["codes"].setdefault(code, _new_index()) if code else compiled["auto"]
+        scope, target = row.get("scope") or "all", row.get("target")
+        if scope == "category":
+            index["category"].setdefault(target, []).append(rule)
+        elif scope == "product":
+            index["product"].setdefault(int(target), []).append(rule)
+        else:
+            index["all"].append(rule)
+    compiled["valid_until"] = min(boundaries) if boundaries else None
+    return compiled
+
+def get_compiled_rules():
+    """取得目前的編譯結果；規則有變動 (版本號)、過了有效時間或 TTL 時才重新編譯"""
+    global _compiled
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    current = _compiled
+    if (current is not None and current["version"] == get_promotions_version()
+            and time.monotonic() - current["compiled_at"] < COMPILE_TTL_SEC
+            and (current["valid_until"] is None or now < current["valid_until"])):
+        return current
+    with _lock:
+        version = get_promotions_version()
+        compiled = compile_rules(load_active_promotions(), now)
+        compiled["version"] = version
+        compiled["compiled_at"] = time.monotonic()
+        _compiled = compiled
+    return compiled
+
+# ==========================================
+# 定價
+# ==========================================
+def _best_in_index(index, subtotal, by_category, by_product, best):
+    """在一個索引裡找折扣最大的規則；best 是目前最佳的 (折扣, 規則)"""
+    candidates = [(subtotal, index["all"])]
+    if index["category"]:
+        candidates += [(amount, index["category"][cat]) for cat, amount in by_category.items() if cat in index["category"]]
+    if index["product"]:
+        candidates += [(amount, index["product"][pid]) for pid, amount in by_product.items() if pid in index["product"]]
+    for eligible, rules in candidates:
+        for rule in rules:
+            _, _, is_percent, value, min_spend = rule
+            if eligible < min_spend or eligible <= 0:
+                continue
+            # 折扣不超過適用金額 (百分比規則在 add_promotion 已限制 <= 100，這裡再保險一次)
+            discount = min(eligible * value // 100 if is_percent else value, eligible)
+            if discount > best[0]:
+                best = (discount, rule)
+    return best
+
+def price_cart(lines, code=None, compiled=None):
+    """
+    lines 是購物車明細 (至少要有 id, category, price, quantity)。
+    回傳 {"original", "discount", "total", "promotion_id", "promotion_name", "code_status"}，
+    code_status：None (沒輸入)、"invalid" (沒有這個碼)、"not_eligible" (未達條件)、"ok"。
+    同一張訂單只套用折扣最大的一條規則。
+    """
+    compiled = compiled or get_compiled_rules()
+
+    # 一次走訪：總金額、各分類小計、各商品小計
+    subtotal = 0
+    by_category, by_product = {}, {}
+    for line in lines:
+        amount = line["price"] * line["quantity"]
+        subtotal += amount
+        by_category[line["category"]] = by_category.get(line["category"], 0) + amount
+        by_product[line["id"]] = by_product.get(line["id"], 0) + amount
+
+    best = _best_in_index(compiled["auto"], subtotal, by_category, by_product, (0, None))
+
+    code_status = None
+    code = (code or "").strip().upper()
+    if code:
+        code_index = compiled["codes"].get(code)
+        if code_index is None:
+            code_status = "invalid"
+        else:
+            code_best = _best_in_index(code_index, subtotal, by_category, by_product, (0, None))
+            code_status = "ok" if code_best[1] else "not_eligible"
+            if code_best[0] > best[0]:
+                best = code_best
+
+    discount, rule = best
+    return {
+        "original": subtotal,
+        "discount": discount,
+        "total": subtotal - discount,
+        "promotion_id": rule[0] if rule else None,
+        "promotion_name": rule[1] if rule else None,
+        "code_status": code_status,
+    }
@@ -0,0 +1,24 @@
+# tests/conftest.py
+# 測試共用設定：讓測試可以直接 import 專案根目錄的模組，每個測試用一個暫存的資料庫檔案
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import cart_store
+import database
+import order_writer
+import pricing
+
+@pytest.fixture
+def db(tmp_path):
+    database.configure_db(str(tmp_path / "test.db"))
+    database.init_db()
+    yield database
+    # 背景執行緒與還沒寫入的購物車不能留到下一個測試 (下一個測試用的是另一個資料庫)
+    order_writer.stop_writer(timeout=5)
+    with cart_store._lock:
+        cart_store._pending.clear()
+    pricing._compiled = None
@@ -0,0 +1,35 @@
+# tests/test_bulk_io.py
+# 商品批次匯入的回歸測試
+import io
+import sqlite3
+
+import bulk_io
+import database
+import image_store
+
+def test_images_are_ingested_outside_write_transaction(db, monkeypatch):
+    # 收錄圖片 (可能要下載、產生縮圖) 時，其他連線仍然拿得到寫入鎖
+    def fake_ingest(source, base_dir=None):
+        other = sqlite3.connect(db.DB_NAME, timeout=0)
+        other.execute("BEGIN IMMEDIATE")
+        other.rollback()
+        other.close()
+        return "0" * 32 + ".png"
+    monkeypatch.setattr(image_store, "ingest", fake_ingest)
+
+    stream = io.StringIO("name,category,price,image,image_file\n紅色海報,其他,100,,red.png\n藍色海報,其他,100,,red.png\n")
+    report = bulk_io.import_products(stream)
+    assert report["committed"] and report["written"] == 2
+    with db.get_conn() as conn:
+        keys = [row[0] for row in conn.execute("SELECT image_key FROM products WHERE name LIKE '%海報'")]
+    assert keys == ["0" * 32 + ".png"] * 2
+
+def test_image_errors_are_reported_per_row(db, monkeypatch):
+    def fake_ingest(source, base_dir=None):
+        raise ValueError("不支援的圖片格式")
+    monkeypatch.setattr(image_store, "ingest", fake_ingest)
+
+    stream = io.StringIO("name,category,price,image,image_file\n壞圖,其他,100,,bad.txt\n")
+    report = bulk_io.import_products(stream)
+    assert not report["committed"]
+    assert report["errors"][0][0] == 1 and "bad.txt" in report["errors"][0][1]
@@ -0,0 +1,41 @@
+# tests/test_cart_store.py
+# 購物車 write-behind 的回歸測試
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import cart_store
+import database
+
+def test_flush_user_does_not_wait_for_writer_backoff(db, monkeypatch):
+    monkeypatch.setattr(cart_store, "FLUSH_DELAY_SEC", 1)
+    failed = threading.Event()
+    def save_carts(carts):
+        if "alice" in carts:
+            failed.set()
+            raise sqlite3.OperationalError("database is locked")
+        database.save_carts(carts)
+    monkeypatch.setattr(cart_store, "save_carts", save_carts)
+
+    cart_store.mark_dirty("alice", {1: 1})
+    assert failed.wait(5)
+    time.sleep(0.05)  # 背景執行緒進入退避等待
+    cart_store.mark_dirty("bob", {2: 1})
+    start = time.monotonic()
+    cart_store.flush_user("bob")
+    assert time.monotonic() - start < 0.5
+    assert database.load_cart("bob") == {2: 1}
+
+def test_failed_flush_user_keeps_pending_cart(db, monkeypatch):
+    def broken(carts):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(cart_store, "save_carts", broken)
+    cart_store.mark_dirty("alice", {1: 2})
+    with pytest.raises(sqlite3.OperationalError):
+        cart_store.flush_user("alice")
+
+    monkeypatch.setattr(cart_store, "save_carts", database.save_carts)
+    cart_store.flush_user("alice")
+    assert database.load_cart("alice") == {1: 2}
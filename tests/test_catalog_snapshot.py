@@ -0,0 +1,33 @@
+# tests/test_catalog_snapshot.py
+# 商品目錄快照的回歸測試：短命的 process 要在結束前發佈，落後的快照在 init_db() 時重建
+import os
+import subprocess
+import sys
+
+import database
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+def test_cli_import_publishes_before_exit(db, tmp_path):
+    database.flush_catalog_snapshot()
+    generation = database._get_snapshot_reader().generation()
+    csv_path = tmp_path / "products.csv"
+    csv_path.write_text("name,category,price,image\n新商品,其他,100,\n", encoding="utf-8")
+    subprocess.run([sys.executable, os.path.join(ROOT, "manage.py"), "--db", database.DB_NAME,
+                    "import-products", str(csv_path)], check=True, capture_output=True)
+
+    assert database._get_snapshot_reader().generation() > generation
+    snapshot = database.get_catalog_snapshot()
+    assert snapshot.source_version == database.get_catalog_source_version()
+    assert [p["name"] for p in database.get_products_by_ids([10]).values()] == ["新商品"]
+
+def test_init_db_republishes_stale_snapshot(db):
+    database.flush_catalog_snapshot()
+    # 別的程式直接改了商品、沒有發佈快照
+    with database.get_conn() as conn:
+        conn.execute("INSERT INTO products (name, category, price, image) VALUES ('漏發佈的商品', '其他', 100, '')")
+    assert database.get_catalog_snapshot().get(10) is None
+
+    database.configure_db(database.DB_NAME)  # 模擬伺服器重啟
+    database.init_db()
+    assert database.get_catalog_snapshot().get(10)["name"] == "漏發佈的商品"
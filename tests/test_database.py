@@ -0,0 +1,43 @@
+# tests/test_database.py
+# 資料層的回歸測試 (db fixture 見 conftest.py)
+
+def test_order_without_username_is_saved(db):
+    # 沒有會員帳號的訂單不計入 user_order_counts (主鍵不能是 NULL)
+    order_id = db.save_order_to_db(None, "訪客", "guest@example.com", "測試路 1 號", 100, 100, 0, "測試商品 x1")
+    with db.get_conn() as conn:
+        assert conn.execute("SELECT username FROM orders WHERE id = ?", (order_id,)).fetchone() == (None,)
+        assert conn.execute("SELECT COUNT(*) FROM user_order_counts").fetchone() == (0,)
+
+def test_order_counts_per_user(db):
+    db.save_order_to_db("alice", "Alice", "a@example.com", "a", 100, 100, 0, "測試商品 x1")
+    db.save_order_to_db("alice", "Alice", "a@example.com", "a", 200, 200, 0, "測試商品 x2")
+    assert db.get_user_order_count("alice") == (2, 0)
+
+def test_sold_out_flush_is_per_transaction(db):
+    # 另一個交易先 flush，不能把這個交易的「商品售完」標記清掉
+    with db.transaction() as conn:
+        product_id = conn.execute("INSERT INTO products (name, category, price, image, stock) "
+                                  "VALUES ('限量商品', '其他', 100, '', 1)").lastrowid
+    with db.get_conn() as writer, db.get_conn() as other:
+        db._begin_immediate(writer)
+        db.write_order(writer, "alice", "Alice", "a@example.com", "a", 100, 100, 0, "限量商品 x1", [(product_id, 100, 1)])
+        db.flush_catalog_changes(other)
+        writer.commit()
+        version = db.get_catalog_version()
+        db.flush_catalog_changes(writer)
+    assert db.get_catalog_version() == version + 1
+
+def test_archive_age_counts_from_closing_time(db):
+    # 100 天前下單、昨天才結案的訂單還不能封存；結案滿 90 天的才搬走
+    old_order = db.save_order_to_db("alice", "Alice", "a@example.com", "a", 100, 100, 0, "測試商品 x1")
+    long_closed = db.save_order_to_db("alice", "Alice", "a@example.com", "a", 100, 100, 0, "測試商品 x1")
+    reopened = db.save_order_to_db("alice", "Alice", "a@example.com", "a", 100, 100, 0, "測試商品 x1")
+    db.update_order_statuses([old_order, long_closed, reopened], "已完成")
+    db.update_order_status(reopened, "處理中")
+    with db.get_conn() as conn:
+        conn.execute("UPDATE orders SET order_date = datetime('now', 'localtime', '-100 days')")
+        conn.execute("UPDATE orders SET closed_at = datetime('now', 'localtime', '-100 days') WHERE id = ?", (long_closed,))
+    assert db.archive_orders(90) == 1
+    with db.get_conn() as conn:
+        assert [row[0] for row in conn.execute("SELECT id FROM orders ORDER BY id")] == [old_order, reopened]
+        assert conn.execute("SELECT closed_at IS NOT NULL FROM orders_archive WHERE id = ?", (long_closed,)).fetchone() == (1,)
@@ -0,0 +1,25 @@
+# tests/test_order_writer.py
+# 背景寫入執行緒的回歸測試
+import threading
+
+import database
+import order_writer
+
+def _order(username="alice"):
+    return order_writer.submit_order(username, "Alice", "a@example.com", "a", 100, 100, 0, "測試商品 x1")
+
+def test_writer_restarts_after_thread_died(db):
+    dead = threading.Thread(target=lambda: None)
+    dead.start()
+    dead.join()
+    order_writer._thread = dead
+    assert _order().result(timeout=5) > 0
+    assert order_writer._thread.is_alive()
+
+def test_post_commit_failure_still_resolves_futures(db, monkeypatch):
+    def broken_flush(conn):
+        raise OSError("disk full")
+    monkeypatch.setattr(database, "flush_catalog_changes", broken_flush)
+    assert _order().result(timeout=5) > 0
+    # 執行緒還活著，下一筆照常寫入
+    assert _order().result(timeout=5) > 0
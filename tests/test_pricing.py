@@ -0,0 +1,40 @@
+# tests/test_pricing.py
+# 定價引擎的回歸測試：折扣上限、促銷名額用完 / 失效後不再報價
+import pytest
+
+import database
+import pricing
+
+LINES = [{"id": 1, "category": "電子產品", "price": 3500, "quantity": 1}]
+
+def _checkout(quote):
+    return database.save_order_to_db("alice", "Alice", "a@example.com", "a", quote["total"], quote["original"],
+                                     quote["discount"], "測試商品 x1", [(1, 3500, 1)], quote["promotion_id"])
+
+def test_percent_rule_over_100_is_rejected(db):
+    with pytest.raises(ValueError):
+        database.add_promotion("超額折扣", "percent", 150)
+
+def test_discount_never_exceeds_eligible_amount():
+    rows = [{"id": 1, "name": "超額折扣", "code": None, "kind": "percent", "value": 150, "scope": "all",
+             "target": None, "min_spend": 0, "starts_at": None, "ends_at": None}]
+    quote = pricing.price_cart(LINES, compiled=pricing.compile_rules(rows))
+    assert quote["discount"] == 3500 and quote["total"] == 0
+
+def test_used_up_promotion_is_no_longer_quoted(db):
+    database.add_promotion("限量折抵", "fixed", 500, usage_limit=1)
+    quote = pricing.price_cart(LINES)
+    assert quote["discount"] == 500
+    _checkout(quote)
+    assert pricing.price_cart(LINES)["promotion_id"] is None
+
+def test_unavailable_promotion_forces_recompile(db):
+    promotion_id = database.add_promotion("自動折抵", "fixed", 500)
+    quote = pricing.price_cart(LINES)
+    assert quote["promotion_id"] == promotion_id
+    # 別的 process 停用了活動 (沒有動到本 process 的版本號)
+    with database.get_conn() as conn:
+        conn.execute("UPDATE promotions SET active = 0 WHERE id = ?", (promotion_id,))
+    with pytest.raises(database.PromotionUnavailableError):
+        _checkout(quote)
+    assert pricing.price_cart(LINES)["promotion_id"] is None
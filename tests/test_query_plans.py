@@ -0,0 +1,15 @@
+# tests/test_query_plans.py
+# 熱門查詢都要走索引：索引被刪掉或改名時這裡會失敗
+import pytest
+
+import database
+
+def test_hot_queries_use_indexes(db):
+    plans = database.check_query_plans()
+    assert set(plans) == set(database.HOT_QUERIES)
+
+def test_dropped_index_is_detected(db):
+    with database.get_conn() as conn:
+        conn.execute("DROP INDEX idx_orders_username")
+    with pytest.raises(AssertionError, match="get_user_orders"):
+        database.check_query_plans()
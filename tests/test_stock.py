@@ -0,0 +1,67 @@
+# tests/test_stock.py
+# 併發搶購最後幾件商品：直接開交易與經過 order_writer 兩種寫入路徑都不能超賣
+import threading
+
+import pytest
+
+import database
+import order_writer
+
+BUYERS = 32
+STOCK = 10
+
+@pytest.mark.parametrize("mode", ["direct", "writer"])
+@pytest.mark.parametrize("quantity", [1, 3])
+def test_concurrent_buyers_never_oversell(db, mode, quantity):
+    with database.transaction() as conn:
+        product_id = conn.execute("INSERT INTO products (name, category, price, image, stock) "
+                                  "VALUES ('限量商品', '其他', 100, '', ?)", (STOCK,)).lastrowid
+    before = database.get_lock_stats()
+    version = database.get_catalog_version()
+    barrier = threading.Barrier(BUYERS)
+    lock = threading.Lock()
+    results = {"ok": 0, "out_of_stock": 0, "error": []}
+
+    def buyer(i):
+        line_items = [(product_id, 100, quantity)]
+        barrier.wait()
+        try:
+            if mode == "writer":
+                order_writer.submit_order(f"buyer{i}", "測試", "e", "a", 100, 100, 0, "限量商品", line_items).result(timeout=30)
+            else:
+                database.save_order_to_db(f"buyer{i}", "測試", "e", "a", 100, 100, 0, "限量商品", line_items)
+            outcome = "ok"
+        except database.OutOfStockError:
+            outcome = "out_of_stock"
+        except Exception as e:
+            with lock:
+                results["error"].append(e)
+            return
+        with lock:
+            results[outcome] += 1
+
+    workers = [threading.Thread(target=buyer, args=(i,)) for i in range(BUYERS)]
+    for w in workers: w.start()
+    for w in workers: w.join()
+
+    assert results["error"] == []
+    assert results["ok"] == STOCK // quantity
+    assert results["out_of_stock"] == BUYERS - STOCK // quantity
+    with database.get_conn() as conn:
+        left = conn.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+        sold = conn.execute("SELECT COALESCE(SUM(quantity), 0) FROM order_items WHERE product_id = ?", (product_id,)).fetchone()[0]
+    assert left >= 0 and left == STOCK - results["ok"] * quantity
+    assert sold == results["ok"] * quantity
+
+    after = database.get_lock_stats()
+    transactions = after["transactions"] - before["transactions"]
+    assert after["busy_failures"] == before["busy_failures"]
+    if mode == "direct":
+        # 每位買家各自拿一次寫入鎖 (買不到的也要進交易才知道)
+        assert transactions == BUYERS
+    else:
+        # 經過 order_writer 時多筆訂單合併成一個交易
+        assert 1 <= transactions <= BUYERS
+    # 賣到剛好 0 件時商品快取要失效
+    if left == 0:
+        assert database.get_catalog_version() > version
@@ -1,7 +1,10 @@
 # ui_components.py
 import streamlit as st
-from data_manager import add_to_cart_callback, update_quantity, clear_cart_callback, submit_order_callback
-from database import get_user_info
+from data_manager import add_to_cart_callback, update_quantity, clear_cart_callback, submit_order_callback, resolve_cart
+from pricing import price_cart
+import image_store
+import perf
+from database import get_user_profile, get_product_categories, get_products_page, search_products, get_also_bought, get_products_by_ids
 
 # ==========================================
 # 介面渲染：美化 CSS
@@ -44,23 +47,27 @@ def apply_styles():
 # ==========================================
 # 介面渲染：商品展示
 # ==========================================
-def display_products(df):
-    st.subheader("🛍️ 商店預覽 (Shop Preview)") 
-    
-    categories = ["全部"] + list(df['category'].unique())
-    selected_cat = st.radio("分類篩選 (Category)", categories, horizontal=True)
-    
-    if selected_cat != "全部":
-        df = df[df['category'] == selected_cat]
+# fragment：切換分類 / 翻頁只重跑商品區，不會重跑整個頁面
+# 分類篩選與分頁都在 SQL 端，一次只產生一頁的商品元件
+PRODUCTS_PAGE_SIZE = 12
+# 「買了這個的人也買了」顯示幾個
+ALSO_BOUGHT_COUNT = 4
+SEARCH_RESULT_LIMIT = 24
 
-    st.markdown("<br>", unsafe_allow_html=True) 
+def _next_products_page(last_id):
+    st.session_state.product_cursors.append(last_id)
+
+def _prev_products_page():
+    if len(st.session_state.product_cursors) > 1:
+        st.session_state.product_cursors.pop()
 
+def _product_grid(df):
     cols = st.columns(3)
     for i, (index, row) in enumerate(df.iterrows()):
         with cols[i % 3]:
             with st.container(border=True):
                 try:
-                    st.image(row['image'], use_container_width=True)
+                    st.image(image_store.product_image_url(row), use_container_width=True)
                 except:
                     st.warning("圖片無法載入")
                 
@@ -69,22 +76,105 @@ def display_products(df):
                 c1.caption(row['category'])
                 c2.markdown(f"**NT$ {row['price']:,}**")
                 
-                st.button("加入購物車 (Add)", key=f"add_{row['id']}", on_click=add_to_cart_callback, args=(row,))
+                # 購物車在另一個 fragment，加入後要整頁重跑一次才會更新
+                sold_out = row.get('stock') == 0
+                if sold_out:
+                    st.caption("🚫 已售完")
+                if st.button("加入購物車 (Add)", key=f"add_{row['id']}", disabled=sold_out):
+                    add_to_cart_callback(row)
+                    st.rerun()
+
+def _also_bought_strip():
+    # 以最後加入購物車的商品為準，從預先算好的共現索引取前幾名
+    last_added = st.session_state.get('last_added')
+    if last_added is None or last_added not in st.session_state.cart:
+        return
+    recs = get_also_bought([last_added], ALSO_BOUGHT_COUNT)
+    if not recs:
+        return
+    source = get_products_by_ids([last_added]).get(last_added)
+    st.markdown(f"##### 🤝 買了「{source['name'] if source else ''}」的人也買了")
+    cols = st.columns(ALSO_BOUGHT_COUNT)
+    for col, item in zip(cols, recs):
+        with col, st.container(border=True):
+            st.markdown(f"**{item['name']}**")
+            st.caption(f"NT$ {item['price']:,}")
+            if st.button("加入", key=f"rec_add_{item['id']}"):
+                add_to_cart_callback(item)
+                st.rerun()
+
+@st.fragment
+@perf.timed("render.display_products")
+def display_products():
+    st.subheader("🛍️ 商店預覽 (Shop Preview)") 
+
+    query = st.text_input("🔍 搜尋商品", placeholder="輸入商品名稱或分類，例如：耳機、Type-C")
+    
+    categories = ["全部"] + get_product_categories()
+    selected_cat = st.radio("分類篩選 (Category)", categories, horizontal=True)
+    category = None if selected_cat == "全部" else selected_cat
+
+    st.markdown("<br>", unsafe_allow_html=True) 
+    _also_bought_strip()
+
+    # 有輸入關鍵字：顯示依相關度排序的搜尋結果
+    if query.strip():
+        df = search_products(query, category, SEARCH_RESULT_LIMIT)
+        if df.empty:
+            st.info(f"找不到符合「{query}」的商品")
+        else:
+            _product_grid(df)
+        return
+
+    # 換分類就回到第一頁；product_cursors 記錄每一頁的起點 (after_id)
+    if st.session_state.get("product_category", "全部") != selected_cat or "product_cursors" not in st.session_state:
+        st.session_state.product_category = selected_cat
+        st.session_state.product_cursors = [None]
+
+    df, has_more = get_products_page(category, st.session_state.product_cursors[-1], PRODUCTS_PAGE_SIZE)
+    if df.empty:
+        st.info("目前沒有商品")
+        return
+    _product_grid(df)
+
+    # 分頁控制
+    page_count = len(st.session_state.product_cursors)
+    if has_more or page_count > 1:
+        p1, p2, p3 = st.columns([1, 2, 1])
+        with p1:
+            st.button("⬅️ 上一頁", key="products_prev", disabled=page_count == 1, on_click=_prev_products_page)
+        with p2:
+            st.caption(f"第 {page_count} 頁")
+        with p3:
+            st.button("下一頁 ➡️", key="products_next", disabled=not has_more, on_click=_next_products_page,
+                      args=(int(df['id'].iloc[-1]) if has_more else None,))
+
+# ==========================================
+# 介面渲染：購物車 + 結帳 (側邊欄 fragment)
+# ==========================================
+# 在 `with st.sidebar:` 底下呼叫。＋／－、清空、優惠碼只會重跑這一塊，商品區不動
+@st.fragment
+def cart_panel():
+    # 購物車明細與金額只在這裡對照目錄一次，兩個區塊共用
+    lines, original_total = resolve_cart(st.session_state.cart)
+    display_cart(lines, original_total)
+    checkout_section(lines)
 
 # ==========================================
 # 介面渲染：購物車側邊欄
 # ==========================================
-def display_cart():
-    st.sidebar.title("🛒 Your Cart")
-    st.sidebar.markdown("---")
+@perf.timed("render.display_cart")
+def display_cart(lines, total_price):
+    st.title("🛒 Your Cart")
+    st.markdown("---")
     
-    if not st.session_state.cart:
-        st.sidebar.info("購物車目前是空的")
+    if not lines:
+        st.info("購物車目前是空的")
         return
 
-    total_price = 0
-    for item_id, item in list(st.session_state.cart.items()):
-        with st.sidebar.container(border=True):
+    for item in lines:
+        item_id = item['id']
+        with st.container(border=True):
             st.markdown(f"**{item['name']}**")
             c1, c2, c3 = st.columns([1, 6, 1])
             with c1: st.button("－", key=f"dec_{item_id}", on_click=update_quantity, args=(item_id, -1))
@@ -92,41 +182,46 @@ def display_cart():
                 st.markdown(f"""<div style='width: 100%; height: 40px; display: flex; justify-content: center; align-items: center; font-size: 18px; font-weight: bold; margin: 0; padding: 0;'>{item['quantity']}</div>""", unsafe_allow_html=True)
             with c3: st.button("＋", key=f"inc_{item_id}", on_click=update_quantity, args=(item_id, 1))
             
-            item_total = item['price'] * item['quantity']
-            st.markdown(f"<div style='text-align: right; color: gray; font-size: 0.9em; margin-top: -10px;'>${item_total:,}</div>", unsafe_allow_html=True)
-            total_price += item_total
+            st.markdown(f"<div style='text-align: right; color: gray; font-size: 0.9em; margin-top: -10px;'>${item['subtotal']:,}</div>", unsafe_allow_html=True)
     
-    st.sidebar.markdown("---")
-    st.sidebar.caption(f"小計: NT$ {total_price:,}")
-    if st.sidebar.button("🗑️ 清空購物車", use_container_width=True):
-        clear_cart_callback() 
+    st.markdown("---")
+    st.caption(f"小計: NT$ {total_price:,}")
+    st.button("🗑️ 清空購物車", use_container_width=True, on_click=clear_cart_callback)
+
+    # 依整台購物車推薦常一起購買的商品
+    recs = get_also_bought([item['id'] for item in lines], 3)
+    if recs:
+        st.markdown("**💡 常一起購買**")
+        for item in recs:
+            c1, c2 = st.columns([5, 1])
+            with c1: st.caption(f"{item['name']}｜NT$ {item['price']:,}")
+            with c2: st.button("＋", key=f"cart_rec_{item['id']}", on_click=add_to_cart_callback, args=(item, False))
 
 # ==========================================
 # 介面渲染：結帳區塊 (含優惠券邏輯)
 # ==========================================
-def checkout_section():
-    st.sidebar.markdown("<br>", unsafe_allow_html=True)
+@perf.timed("render.checkout_section")
+def checkout_section(lines):
+    st.markdown("<br>", unsafe_allow_html=True)
     
-    if st.session_state.cart:
+    if lines:
         if not st.session_state.get('current_user'):
-            st.sidebar.warning("🔒 請先登入會員才能結帳")
+            st.warning("🔒 請先登入會員才能結帳")
             return 
 
-        with st.sidebar.expander("💳 結帳確認 (Checkout)", expanded=True):
-            # 1. 計算原始金額
-            original_total = sum(item['price'] * item['quantity'] for item in st.session_state.cart.values())
-            
-            # 2. 優惠券邏輯 (你修改過的版本)
+        with st.expander("💳 結帳確認 (Checkout)", expanded=True):
+            # 1. 定價引擎一次算出原始金額與最佳折扣 (自動套用的活動 + 優惠碼)
             coupon_code = st.text_input("🎟️ 優惠代碼 (Coupon)", placeholder="輸入優惠碼")
-            discount = 0
+            quote = price_cart(lines, coupon_code)
+            original_total, discount, final_total = quote["original"], quote["discount"], quote["total"]
             
-            if coupon_code == "VIP888":
-                discount = int(original_total * 0.1) # 打九折
-                st.success("🎉 優惠碼生效！折抵 10%")
-            elif coupon_code:
+            # 2. 優惠提示
+            if quote["code_status"] == "invalid":
                 st.error("❌ 無效的優惠碼")
-            
-            final_total = original_total - discount
+            elif quote["code_status"] == "not_eligible":
+                st.warning("⚠️ 購物車內容未達此優惠碼的使用條件")
+            if quote["promotion_id"]:
+                st.success(f"🎉 已套用「{quote['promotion_name']}」，折抵 ${discount:,}")
             
             # 3. 顯示金額明細
             st.markdown(f"""
@@ -138,20 +233,29 @@ def checkout_section():
             </div>
             """, unsafe_allow_html=True)
 
-            # 4. 取得使用者資料
-            user_info = get_user_info(st.session_state.current_user)
+            # 4. 取得使用者資料 (登入時已放進 session，重跑不再查詢資料庫)
+            if st.session_state.get('profile') is None:
+                st.session_state.profile = get_user_profile(st.session_state.current_user)
+            user_info = st.session_state.profile
             saved_name = user_info.get('real_name') if user_info else ""
             saved_email = user_info.get('email') if user_info else ""
             saved_addr = user_info.get('address') if user_info else ""
 
-            # 5. 送出訂單
+            # 5. 庫存提示 (以目錄快取為準；真正的檢查在下單交易內)
+            short_lines = [line for line in lines if line.get('stock') is not None and line['quantity'] > line['stock']]
+            for line in short_lines:
+                st.error(f"🚫 「{line['name']}」庫存不足：目前剩 {line['stock']} 件，請調整數量")
+            if short_lines:
+                return
+
+            # 6. 送出訂單
             if saved_name and saved_addr:
                 st.info("📦 將配送至以下地址：")
                 st.markdown(f"**收件人：** {saved_name}")
                 st.markdown(f"**地址：** {saved_addr}")
                 
                 if st.button("🚀 確認下單 (Place Order)", use_container_width=True):
-                    submit_order_callback(saved_name, saved_email, saved_addr, original_total, discount, final_total)
+                    submit_order_callback(saved_name, saved_email, saved_addr, lines, original_total, discount, final_total, quote["promotion_id"])
             else:
                 st.warning("⚠️ 您的會員資料不完整，請手動填寫")
                 with st.form("checkout_form"):
@@ -161,4 +265,4 @@ def checkout_section():
                     
                     submitted = st.form_submit_button("確認下單")
                     if submitted:
-                        submit_order_callback(name, email, address, original_total, discount, final_total)
\ No newline at end of file
+                        submit_order_callback(name, email, address, lines, original_total, discount, final_total, quote["promotion_id"])
\ No newline at end of file